@@ -131,7 +131,11 @@ from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from operator import itemgetter
 
-chatgpt = ChatOpenAI(model="gpt-4o", temperature=0)
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+# the rate limiter keeps batched answer generation under the API request rate
+chatgpt = ChatOpenAI(model="gpt-4o", temperature=0,
+                     rate_limiter=InMemoryRateLimiter(requests_per_second=5, max_bucket_size=10))
 
 def format_docs(docs):
   return "\n\n".join(doc.page_content for doc in docs)
@@ -364,3 +368,61 @@ result = evaluate([test_case], [geval_metric])
 
 # Print results
 print(result)
+
+"""Batch evaluation over the whole dataset
+
+Instead of building one LLMTestCase by hand and calling evaluate() per metric, the runner
+1. answers every question through rag_chain_w_sources.batch with bounded concurrency
+2. scores all metrics for all cases concurrently (bounded + rate limited judge calls)
+3. writes answers.jsonl / results.jsonl per case and results.parquet + summary.json
+Every case is checkpointed as soon as it is done, so re-running the cell after an interruption
+continues where it stopped (upload rag_evaluation.py next to this notebook)
+
+rag_eval_docs.csv has no question column, so we ask one question per document from its title
+and use the document text as the expected output; use your own question/answer columns if you have them
+"""
+
+from rag_evaluation import arun_evaluation, JudgeCache
+from deepeval.metrics import (ContextualPrecisionMetric, ContextualRecallMetric, ContextualRelevancyMetric,
+                              AnswerRelevancyMetric, FaithfulnessMetric, HallucinationMetric, GEval)
+from deepeval.test_case import LLMTestCaseParams
+
+eval_rows = [
+    {"id": doc['id'], "question": f"What is {doc['title']}?", "expected_output": doc['context']}
+    for doc in docs
+]
+
+# factories, because each (case, metric) pair needs its own metric instance
+metric_factories = {
+    "contextual_precision": lambda: ContextualPrecisionMetric(threshold=0.55, model='gpt-4o', include_reason=True),
+    "contextual_recall": lambda: ContextualRecallMetric(threshold=0.55, model='gpt-4o', include_reason=True),
+    "contextual_relevancy": lambda: ContextualRelevancyMetric(threshold=0.55, model='gpt-4o', include_reason=True),
+    "answer_relevancy": lambda: AnswerRelevancyMetric(threshold=0.55, model='gpt-4o', include_reason=True),
+    "faithfulness": lambda: FaithfulnessMetric(threshold=0.55, model='gpt-4o', include_reason=True),
+    "hallucination": lambda: HallucinationMetric(threshold=0.55, model='gpt-4o', include_reason=True),
+    "geval_relevance": lambda: GEval(
+        name="Relevance Evaluation",
+        criteria="The response should be relevant to the input question and information provided in the context.",
+        evaluation_params=[LLMTestCaseParams.INPUT, LLMTestCaseParams.CONTEXT],
+        threshold=0.6,
+        model="gpt-4o-mini"
+    ),
+}
+
+# verdicts are cached on disk by (metric name, metric config, hash of the test-case fields the metric reads):
+# after a prompt change, run into a new output_dir and only the cases whose answer/context changed are re-judged;
+# summary['judge_cache'] shows the hit rate overall and per metric
+judge_cache = JudgeCache('/content/judge_cache.sqlite')
+
+eval_summary = await arun_evaluation(
+    rag_chain_w_sources,
+    eval_rows,
+    metric_factories,
+    output_dir='/content/eval_results',
+    answer_concurrency=8,      # questions answered at once
+    metric_concurrency=16,     # judge calls in flight at once
+    requests_per_second=5,     # judge calls started per second
+    judge_cache=judge_cache
+)
+
+pd.read_parquet('/content/eval_results/results.parquet')
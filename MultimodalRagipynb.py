@@ -35,19 +35,33 @@ nltk.download('averaged_perceptron_tagger')
 #!wget https://sgp.fas.org/crs/misc/IF10244.pdf
 
 !pip install htmltabletomd==1.0.0
+!pip install pypdf
 
+import os
 #IF THERE IS ANY FIGURE/IMAGE FILE REMOVE IT ,But right now we have only pdf (remove references)
 !rm -rf /content/figures
 
-from langchain_community.document_loaders.pdf import UnstructuredPDFLoader
+"""hi_res partitioning (layout detection + OCR) of a whole PDF in one process takes minutes,
+so we split the PDF into page ranges and partition them in a process pool.
+The elements come back in page order with the same metadata as UnstructuredPDFLoader(mode='elements')
+(upload multimodal_rag.py next to this notebook)"""
+
+from multimodal_rag import partition_pdf_parallel
 doc = '/content/sample_data/transformer_paper (1).pdf'
-loader = UnstructuredPDFLoader(file_path=doc, strategy='hi_res', extract_images_in_pdf=True,
-                               infer_table_structure=True, mode='elements',
-                               image_output_dir_path='/content/figures')
-data = loader.load()
+pdf_path = doc  # `doc` is reused as a loop variable below
+data = partition_pdf_parallel(doc, image_output_dir='/content/figures', max_workers=os.cpu_count())
 
 len(data)
 
+"""throughput check: pages/sec against number of worker processes on a local sample corpus.
+It re-partitions the document once per worker count, so it is off by default; set RUN_PARTITION_BENCHMARK = True to run it."""
+
+RUN_PARTITION_BENCHMARK = False
+
+if RUN_PARTITION_BENCHMARK:
+  from multimodal_rag import benchmark_partitioning
+  benchmark_partitioning([doc], worker_counts=(1, 2, 4))
+
 [doc.metadata['category'] for doc in data]
 
 data[0].page_content
@@ -74,27 +88,23 @@ import htmltabletomd
 md_table = htmltabletomd.convert_table(data[92].metadata['text_as_html'])
 print(md_table)
 
-"""seperate data into text and table"""
-
-docs = []
-tables = []
-for doc in data:
-    if doc.metadata['category']=='Table':
-        tables.append(doc)
-    elif doc.metadata['category']=='NarrativeText':
-        docs.append(doc)
-    elif doc.metadata['category']=='Title':
-        docs.append(doc)
-    elif doc.metadata['category']=='UncategorizedText':
-        docs.append(doc)
-    elif doc.metadata['category']=='Header':
-        docs.append(doc)
-    elif doc.metadata['category']=='FigureCaption':
-        docs.append(doc)
-
-print(len(docs))
+"""seperate data into text and table
+
+Instead of sending every Title/Header/NarrativeText/... element to the LLM on its own (many are a few words),
+text elements are merged into section-level chunks under their titles (up to CHUNK_MAX_TOKENS),
+keeping provenance (pages, element indices, categories) in metadata.
+Figure captions are attached to their images (metadata['caption']) and used in the image summaries"""
+
+from multimodal_rag import merge_section_chunks, TEXT_CATEGORIES
+
+tables = [doc for doc in data if doc.metadata['category']=='Table']
+section_chunks = merge_section_chunks(data, max_tokens=1000)
+
+print(len([doc for doc in data if doc.metadata['category'] in TEXT_CATEGORIES]), 'text elements ->', len(section_chunks), 'section chunks')
 print(len(tables))
 
+section_chunks[0].metadata
+
 ## Convert HTML tables to Markdown
 for table in tables:
   table.page_content = htmltabletomd.convert_table(table.metadata['text_as_html'])
@@ -164,11 +174,17 @@ summarize_chain = ({"element":RunnablePassthrough()} | prompt | chatgpt | StrOut
 text_summaries = []
 table_summaries = []
 
-text_docs = [doc.page_content for doc in docs]
+text_docs = [doc.page_content for doc in section_chunks]
 table_docs = [table.page_content for table in tables]
 
-text_summaries = summarize_chain.batch(text_docs, {"max_concurrency":5})#concurrency-how many iterations or how many times a paragh is sumarized
-table_summaries = summarize_chain.batch(table_docs, {"max_concurrency":5})
+"""summaries are cached on disk by hash(element content, prompt, model),
+so re-running on an unchanged document makes zero LLM calls (only new/changed elements are summarized)"""
+
+from multimodal_rag import SummaryCache, summarize_with_cache
+summary_cache = SummaryCache('/content/summary_cache.sqlite')
+
+text_summaries = summarize_with_cache(summarize_chain, text_docs, summary_cache, prompt_text, 'gpt-4o-mini', max_concurrency=5)#concurrency-how many iterations or how many times a paragh is sumarized
+table_summaries = summarize_with_cache(summarize_chain, table_docs, summary_cache, prompt_text, 'gpt-4o-mini', max_concurrency=5)
 
 print(len(text_summaries))
 print(len(table_summaries))
@@ -201,33 +217,20 @@ import os
 import base64
 
 from langchain_core.messages import HumanMessage
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from multimodal_rag import generate_img_summaries_concurrent
 
-def encode_image(image_path):
-  """Getting the base64 string"""
-  with open(image_path, "rb") as image_file:
-    return base64.b64encode(image_file.read()).decode('utf-8')
-
-def image_summarize(img_base64, prompt):
-  """Make image summary"""
-  chat = ChatOpenAI(model_name='gpt-4o-mini', temperature=0, api_key = OPEN_API_KEY)
-  msg = chat.invoke(
-      [
-          HumanMessage(content=[{"type":"text", "text":prompt},
-                                {"type":"image_url",
-                                 "image_url": {"url":f"data:image/jpeg;base64,{img_base64}"}}])
-      ]
-  )
-  return msg.content
+# one vision client for all images; the rate limiter keeps concurrent calls under the API request rate
+vision_chat = ChatOpenAI(model_name='gpt-4o-mini', temperature=0, api_key = OPEN_API_KEY,
+                         rate_limiter=InMemoryRateLimiter(requests_per_second=5, max_bucket_size=10))
 
 def generate_img_summaries(path):
   """
   Generate summaries and base64 encoded strings for images path:
   Path to list of .jpg files extracted by UnstructuredPDFLoader
+
+  Images are downscaled to a pixel budget in a process pool and summarized concurrently
   """
-  # store base64 encoded image
-  img_base64_list = []
-  # store summaries
-  img_summaries = []
   # prompt
   prompt = """
   You are an assistant tasked with summarizing images for retrieval.
@@ -237,13 +240,12 @@ def generate_img_summaries(path):
   Do not add additional words like summary: etc.
   """
 
-  # Apply to image
-  for img_file in sorted(os.listdir(path)):
-    if img_file.endswith('.jpg'):
-      img_path = os.path.join(path, img_file)
-      base64_image = encode_image(img_path)
-      img_base64_list.append(base64_image)
-      img_summaries.append(image_summarize(base64_image, prompt))
+  # store base64 encoded (downscaled) images and their summaries; stats has images/sec and bytes saved
+  # captions attached by merge_section_chunks, keyed by figure file name
+  captions = {os.path.basename(d.metadata['image_path']): d.metadata['caption']
+              for d in data if d.metadata.get('caption') and d.metadata.get('image_path')}
+  img_base64_list, img_summaries, stats = generate_img_summaries_concurrent(
+      path, prompt, vision_chat, 'gpt-4o-mini', cache=summary_cache, max_concurrency=8, captions=captions)
   return img_base64_list, img_summaries
 
 # Image summary -multiple assignment
@@ -258,26 +260,21 @@ imgs_base64, img_summaries = generate_img_summaries(IMG_PATH)
 | GIF image  | `image/gif`        | `.gif`                |
 | PDF file   | `application/pdf`  | `.pdf`                |
 
-So this loop = “Go through every image in the folder, turn it into text, and get the AI’s summary.”
-os.listdir(path) → lists all files in that folder.
-
-sorted(...) → arranges them in order (A to Z).
-
-if img_file.endswith('.jpg'): → checks if it’s a picture file.
-
-os.path.join(path, img_file) → builds the full file path (folder + filename).
-
-encode_image(img_path) → turns the image into base64 text.
-
-img_base64_list.append(...) → saves the base64 code.
+So this step = “Go through every image in the folder, turn it into text, and get the AI’s summary.”
+generate_img_summaries_concurrent(...) → lists the .jpg files in that folder (A to Z),
+downscales each one to the pixel budget in a process pool, turns it into base64 text,
+and asks the AI to describe the pictures concurrently (cached summaries are reused).
 
-image_summarize(...) → asks the AI to describe the picture.
+img_base64_list → the base64 code of each (downscaled) image.
 
-img_summaries.append(...) → saves that description.
+img_summaries → the AI's description of each image, in the same order.
 """
 
 len(imgs_base64), len(img_summaries)
 
+#cache hit/miss statistics for text, table and image summaries
+summary_cache.stats()
+
 imgs_base64[1]
 
 display(Image('./figures/figure-4-2.jpg'))
@@ -314,7 +311,7 @@ from langchain_openai import OpenAIEmbeddings
 # details here: https://openai.com/blog/new-embedding-models-and-api-updates
 openai_embed_model = OpenAIEmbeddings(model='text-embedding-3-small',api_key=OPEN_API_KEY)
 
-docs[0]
+section_chunks[0]
 
 """Add to vectorstore & docstore
 Add raw docs and doc summaries to Multi Vector Retriever:
@@ -324,8 +321,6 @@ Store the texts, table summaries, and image summaries and their corresponding em
 Connect them using a common document_id
 """
 
-import uuid
-
 from langchain_community.storage import RedisStore
 print("redis done")
 from langchain_community.utilities.redis import get_client
@@ -336,6 +331,7 @@ from langchain_core.documents import Document
 print("document done")
 from langchain_openai import OpenAIEmbeddings
 print("embeddings done")
+from multimodal_rag import RECORD_TEXT, RECORD_TABLE, RECORD_IMAGE, MultiVectorRetriever, sync_source
 #from langchain.retrievers.multi_vector import MultiVectorRetriever
 #from langchain_community.retrievers.multi_vector import MultiVectorRetriever
 #from langchain.retrievers.multi_vector import MultiVectorRetriever
@@ -378,52 +374,43 @@ but .set() actually puts the stories inside those drawers.
 """
 
 def create_multi_vector_retriever(
-    docstore, vectorstore, text_summaries, texts, table_summaries, tables, image_summaries, images
+    docstore, vectorstore, text_summaries, texts, table_summaries, tables, image_summaries, images,
+    source=pdf_path
 ):
     """
-    Create retriever that indexes summaries, but returns raw images or texts
+    Create retriever that indexes summaries, but returns raw images or texts.
+    Indexing is incremental: ids are derived from source + content, so re-running on the
+    same PDF only embeds new elements, and elements from removed pages are deleted
     """
 
 
-    id_key = "doc_id" #every time user gives it it produce unique id(its used as key in the input of Document for summary docs)
-
+    id_key = "doc_id" #derived from the content of each element (its used as key in the input of Document for summary docs)
 
-        # Use vectorstore.as_retriever instead of MultiVectorRetriever
-    retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 5})
 
-    # Helper function to add documents to the vectorstore and docstore
-    def add_documents(doc_summaries, doc_contents):
-        doc_ids = [str(uuid.uuid4()) for _ in doc_contents]
-        summary_docs = [
-            Document(page_content=s, metadata={id_key: doc_ids[i]})
-            for i, s in enumerate(doc_summaries)
-        ]
-        vectorstore.add_documents(summary_docs)
-        # Use mset method for RedisStore as it expects multiple key-value pairs
-        doc_pairs = [(doc_id, doc_content) for doc_id, doc_content in zip(doc_ids, doc_contents)]
-        if doc_pairs:
-            docstore.mset(doc_pairs)
+    # searches the summaries, collapses hits to unique parent doc_ids and fetches all parents with one batched mget
+    retriever = MultiVectorRetriever(vectorstore, docstore, id_key=id_key, k=5)
 
+    # every docstore value is a typed record (type tag + MIME type + payload), images as raw bytes
+    # images arrive base64-encoded from generate_img_summaries; decode once here and store the bytes
+    items = (
+        [(RECORD_TEXT, s, t, None) for s, t in zip(text_summaries, texts)]
+        + [(RECORD_TABLE, s, t, None) for s, t in zip(table_summaries, tables)]
+        + [(RECORD_IMAGE, s, base64.b64decode(i), "image/jpeg") for s, i in zip(image_summaries, images)]
+    )
 
-    # Add texts, tables, and images
-    # Check that text_summaries is not empty before adding
-    if text_summaries:
-        add_documents(text_summaries, texts)
-    # Check that table_summaries is not empty before adding
-    if table_summaries:
-        add_documents(table_summaries, tables)
-    # Check that image_summaries is not empty before adding
-    if image_summaries:
-        add_documents(image_summaries, images)
+    # upsert new elements, skip unchanged ones, delete the ones no longer in the PDF
+    sync_source(vectorstore, docstore, source, items, id_key=id_key)
 
     return retriever
 
 
 # The vectorstore to use to index the summaries and their embeddings
+# persisted to disk, so a restart reloads the index instead of re-embedding everything
 chroma_db = Chroma(
     collection_name="mm_rag",
     embedding_function=openai_embed_model,
     collection_metadata={"hnsw:space": "cosine"},
+    persist_directory="/content/chroma_mm_rag",
 )
 
 # Initialize the storage layer - to store raw images, text and tables
@@ -444,13 +431,30 @@ retriever_multi_vector = create_multi_vector_retriever(
     imgs_base64,
 )
 
+"""Tables are also kept as typed SQL tables (parsed from text_as_html), under the same id as
+their summary, so sort/top-k/aggregate questions run as local queries instead of asking the LLM
+to sort markdown"""
+
+from multimodal_rag import TableStore, query_tables
+table_store = TableStore('/content/table_store.sqlite')
+table_ids = [table_store.add_element(pdf_path, table.page_content, table.metadata['text_as_html'],
+                                     table.metadata.get('page_number'))
+             for table in tables if table.metadata.get('text_as_html')]
+table_store.prune(pdf_path, table_ids)
+
+"""For a whole directory of PDFs use the streaming pipeline instead of the cells above:
+partition, summarize and store run as overlapping stages with bounded queues, and per-stage
+throughput and queue depth are printed while it runs
+
+python multimodal_rag.py /content/pdfs --persist-directory /content/chroma_mm_rag --summary-cache /content/summary_cache.sqlite
+"""
+
 """check retrieval"""
 
 query = "Find the story about magic wand"
-summary_results = retriever_multi_vector.invoke(query)
 
-# Get full content
-full_docs = [redis_store.mget([doc.metadata["doc_id"]])[0] for doc in summary_results]
+# Get full content (the retriever already returns the raw records, fetched in one mget)
+full_docs = retriever_multi_vector.invoke(query)
 
 """Storage	What’s inside	Role
 RedisStore	-Full text, tables, images	Bookshelf with complete content
@@ -462,10 +466,12 @@ What this code chunk does
 Many times, in your project, images are stored as base64 strings in your database (like Redis) or in Chroma metadata.
 Base64 is a text version of an image — good for storage and transfer, but you cannot see it directly.
 
+Here the docstore keeps images as typed records with raw bytes, so no base64 decoding is needed to look at them.
+
 The function:
-plt_img_base64(img_base64)
-Takes the base64 string
-Converts it back to a normal image
+plt_img(image)
+Takes an image record ({"data": bytes, "mime_type": ...})
+Opens the bytes as a normal image
 Displays it in Jupyter or Colab
 So now you can actually look at the image, not just its text code.
 
@@ -483,12 +489,10 @@ from PIL import Image
 import base64
 from io import BytesIO
 
-def plt_img_base64(img_base64):
-    """Disply base64 encoded string as image"""
-    # Decode the base64 string
-    img_data = base64.b64decode(img_base64)
-    # Create a BytesIO object
-    img_buffer = BytesIO(img_data)
+def plt_img(image):
+    """Disply an image record from the docstore"""
+    # Create a BytesIO object over the raw image bytes
+    img_buffer = BytesIO(image["data"])
     # Open the image using PIL
     img = Image.open(img_buffer)
     display(img)
@@ -509,64 +513,22 @@ We need to bin the retrieved doc(s) into the correct parts of the GPT-4o prompt
 Here we need to have text, table elements as one set of inputs and image elements as the other set of inputs as both require separate prompts in GPT-4o.
 """
 
-import re
-import base64
 from operator import itemgetter
 from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.messages import HumanMessage
-
-def looks_like_base64(sb):
-    """Check if the string looks like base64"""
-    return re.match("^[A-Za-z0-9+/]+[=]{0,2}$", sb) is not None
-
-
-def is_image_data(b64data_str):
-    """
-    Check if the base64 data string is an image by looking at the start of the data
-    """
-    image_signatures = {
-        b"\xff\xd8\xff": "jpg",
-        b"\x89\x50\x4e\x47\x0d\x0a\x1a\x0a": "png",
-        b"\x47\x49\x46\x38": "gif",
-        b"\x52\x49\x46\x46": "webp",
-    }
-    try:
-        header = base64.b64decode(b64data_str)[:8]
-        for sig, format in image_signatures.items():
-            if header.startswith(sig):
-                return True
-        return False
-    except Exception:
-        return False
-
+from multimodal_rag import split_records, decode_record, image_data_url
 
 def split_image_text_types(raw_docs_from_docstore):
     """
-    Split base64-encoded images and texts from raw content fetched from docstore.
+    Split images and texts from raw records fetched from docstore.
+    Each record carries its type tag, so this reads a short header per item:
+    no regex scans or base64 decoding of (possibly multi-megabyte) images.
     """
-    b64_images = []
-    texts = []
-    for item in raw_docs_from_docstore:
-        if item is None:
-            continue
-
-        current_content_str = ""
-        if isinstance(item, bytes):
-            current_content_str = item.decode('utf-8', errors='ignore')
-        elif isinstance(item, str):
-            current_content_str = item
-
-        if looks_like_base64(current_content_str) and is_image_data(current_content_str):
-            b64_images.append(current_content_str)
-        else:
-            texts.append(current_content_str)
-    return {"images": b64_images, "texts": texts}
+    return split_records(raw_docs_from_docstore)
 
 # Assuming redis_store and retriever_multi_vector are initialized
 query = "what is transformer"
-summary_docs = retriever_multi_vector.invoke(query) # These are Document objects with summaries
-doc_ids = [doc.metadata["doc_id"] for doc in summary_docs]
-raw_contents = redis_store.mget(doc_ids) # This retrieves the raw content (base64 string or text) as bytes
+raw_contents = retriever_multi_vector.invoke(query) # This retrieves the typed records (text, table or raw image bytes)
 
 # Now, split the raw_contents into images and texts
 split_results = split_image_text_types(raw_contents)
@@ -576,7 +538,7 @@ image_docs = split_results['images']
 
 # Check if there are any images to display
 if image_docs:
-    plt_img_base64(image_docs[0])
+    plt_img(image_docs[0])
 else:
     print("No images found in the retrieved context for this query.")
 
@@ -590,48 +552,81 @@ len(docs)
 docs
 
 query = "what is BERT.Explain it in detail"
-summary_docs_for_test = retriever_multi_vector.invoke(query)
-doc_ids_for_test = [doc.metadata["doc_id"] for doc in summary_docs_for_test]
-raw_contents_for_test = redis_store.mget(doc_ids_for_test)
+raw_contents_for_test = retriever_multi_vector.invoke(query)
 
 # Assuming docs[2] was intended to be an image from the raw content
 # Check if raw_contents_for_test[2] exists and is an image
 if len(raw_contents_for_test) > 2 and raw_contents_for_test[2] is not None:
-    test_item = raw_contents_for_test[2]
-    if isinstance(test_item, bytes):
-        test_item = test_item.decode('utf-8', errors='ignore')
-    print(is_image_data(test_item))
+    print(decode_record(raw_contents_for_test[2])["type"] == "image")
 else:
     print("Raw content at index 2 is not available for testing.")
 
 query = "Tell me detailed statistics of the top 5 years with largest wildfire acres burned"
-summary_docs_for_test = retriever_multi_vector.invoke(query)
-doc_ids_for_test = [doc.metadata["doc_id"] for doc in summary_docs_for_test]
-raw_contents_for_test = redis_store.mget(doc_ids_for_test)
+raw_contents_for_test = retriever_multi_vector.invoke(query)
+
+# numeric question: find the relevant table summaries, then sort/limit locally in SQLite
+# only the few result rows (not the whole table) need to go to the model
+def table_query_answer(query):
+  table_hits = chroma_db.similarity_search(query, k=3, filter={"type": RECORD_TABLE})
+  return query_tables(chatgpt, query, table_store, [hit.metadata["doc_id"] for hit in table_hits])
+
+table_answer = table_query_answer(query)
+if table_answer:
+    print(table_answer["sql"])
+    print(table_answer["text"])
 
 # Assuming docs[2] was intended to be an image from the raw content
 if len(raw_contents_for_test) > 2 and raw_contents_for_test[2] is not None:
-    test_item = raw_contents_for_test[2]
-    if isinstance(test_item, bytes):
-        test_item = test_item.decode('utf-8', errors='ignore')
-    print(is_image_data(test_item))
+    print(decode_record(raw_contents_for_test[2])["type"] == "image")
 else:
     print("Raw content at index 2 is not available for testing.")
 
 query = "What is BERT"
-summary_docs_for_split = retriever_multi_vector.invoke(query)
-doc_ids_for_split = [doc.metadata["doc_id"] for doc in summary_docs_for_split]
-raw_contents_for_split = redis_store.mget(doc_ids_for_split)
+raw_contents_for_split = retriever_multi_vector.invoke(query)
 
 r = split_image_text_types(raw_contents_for_split)
 r
 
 # Assuming 'r' from the previous cell is correctly populated with split_image_text_types(raw_contents)
 if r and r['images']:
-    plt_img_base64(r['images'][0])
+    plt_img(r['images'][0])
 else:
     print("No images found in 'r' for display.")
 
+"""Hybrid retrieval: cosine similarity over summaries misses exact terms ("BERT", table column names, numbers),
+so a local BM25 index over the same summaries + raw text is fused with the vector ranking by reciprocal rank fusion.
+Everything runs offline next to Chroma; rebuild the BM25 index after re-indexing"""
+
+from multimodal_rag import BM25Index, HybridRetriever, benchmark_retrievers, element_id
+
+bm25_index = BM25Index.from_vectorstore(chroma_db, redis_store)
+retriever_hybrid = HybridRetriever(chroma_db, redis_store, bm25_index, k=5, vector_weight=1.0, bm25_weight=1.0)
+
+# small hand-labelled query set: each question is answered on known pages of the transformer paper,
+# and the section chunks and tables from those pages are relevant (page provenance, not term matching,
+# so the labels do not favour either retriever)
+labelled_pages = {
+    "How is scaled dot-product attention computed?": {4},
+    "How many parallel attention heads does the model use?": {5},
+    "Why does the model use sinusoidal positional encodings?": {6},
+    "Which optimizer and learning rate schedule were used for training?": {7},
+    "What BLEU score does the big model reach on WMT 2014 English-to-German?": {8},
+}
+def relevant_ids(pages):
+  # ids are derived the same way create_multi_vector_retriever stored the elements
+  return ({element_id(pdf_path, RECORD_TEXT, doc.page_content) for doc in section_chunks
+           if pages & set(doc.metadata['page_numbers'])}
+          | {element_id(pdf_path, RECORD_TABLE, table.page_content) for table in tables
+             if table.metadata.get('page_number') in pages})
+
+labelled_queries = [(query, relevant_ids(pages)) for query, pages in labelled_pages.items()]
+labelled_queries = [(query, relevant) for query, relevant in labelled_queries if relevant]
+
+# recall / MRR of the top-5 and latency per query, vector only vs hybrid
+benchmark_retrievers({"vector": retriever_multi_vector, "hybrid": retriever_hybrid}, labelled_queries)
+
+retriever_hybrid.invoke("what is BERT")
+
 """## Multimodal RAG
 
 ### Build End-to-End Multimodal RAG Pipeline
@@ -649,13 +644,21 @@ def multimodal_prompt_function(data_dict):
     Create a multimodal prompt with both text and image context.
 
     This function formats the provided context from `data_dict`, which contains
-    text, tables, and base64-encoded images. It joins the text (with table) portions
-    and prepares the image(s) in a base64-encoded format to be included in a message.
+    text, tables, and image records (raw bytes) already fitted to the token budget by
+    budget_context. It joins the text (with table) portions and base64-encodes the image(s)
+    only here, when the message is built, at the detail level the budgeter picked.
 
     The formatted text and images (context) along with the user question are used to
     construct a prompt for GPT-4o
     """
     formatted_texts = "\n".join(data_dict["context"]["texts"])
+    # numbers computed locally over the stored tables; the model reports them instead of re-deriving them
+    table_result = ""
+    if data_dict.get("table_answer"):
+        table_result = (
+            "Result of a SQL query over the tables (use these numbers as they are):\n"
+            f"{data_dict['table_answer']['sql']}\n{data_dict['table_answer']['text']}"
+        )
     messages = []
 
     # Adding image(s) to the messages if present
@@ -663,7 +666,7 @@ def multimodal_prompt_function(data_dict):
         for image in data_dict["context"]["images"]:
             image_message = {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{image}"},
+                "image_url": {"url": image_data_url(image), "detail": image.get("detail", "auto")},
             }
             messages.append(image_message)
 
@@ -686,6 +689,8 @@ def multimodal_prompt_function(data_dict):
                 Context documents:
                 {formatted_texts}
 
+                {table_result}
+
                 Answer:
             """
         ),
@@ -699,6 +704,7 @@ multimodal_rag = (
         {
             "context": itemgetter('context'),
             "question": itemgetter('input'),
+            "table_answer": itemgetter('table_answer'),
         }
             |
         RunnableLambda(multimodal_prompt_function)
@@ -708,18 +714,24 @@ multimodal_rag = (
         StrOutputParser()
 )
 
+from multimodal_rag import budget_context
+
 # Pass input query to retriever and get context document elements
+# budget_context keeps them (in retrieval order) within one token budget: near-duplicate images are
+# dropped and each image gets the most detailed level/resolution that still fits
 retrieve_docs = (itemgetter('input')
                     |
                 retriever_multi_vector
                     |
-                RunnableLambda(split_image_text_types))
+                RunnableLambda(lambda records: budget_context(records, token_budget=6000, image_share=0.5)))
 
 # Below, we chain `.assign` calls. This takes a dict and successively
 # adds keys-- "context" and "answer"-- where the value for each key
 # is determined by a Runnable (function or chain executing at runtime).
 # This helps in also having the retrieved context along with the answer generated by GPT-4o
-multimodal_rag_w_sources = (RunnablePassthrough.assign(context=retrieve_docs)
+# table_answer holds the local SQL result (or None) for questions the stored tables can answer
+multimodal_rag_w_sources = (RunnablePassthrough.assign(context=retrieve_docs,
+                                                      table_answer=itemgetter('input') | RunnableLambda(table_query_answer))
                                                .assign(answer=multimodal_rag)
 )
 
@@ -742,7 +754,7 @@ def multimodal_rag_qa(query):
         display(Markdown(text))
         print()
     for img in img_sources:
-        plt_img_base64(img)
+        plt_img(img)
         print()
     print('=='*50)
 
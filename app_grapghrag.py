@@ -1,5 +1,5 @@
 import streamlit as st
-from graph_rag_withneo4j import rag_query, create_knowledge_graph, sample_hotel_reviews
+from graph_rag_withneo4j import rag_query_stream, ensure_knowledge_graph, get_default_engine, sample_hotel_reviews
 import os
 from dotenv import load_dotenv
 
@@ -79,11 +79,13 @@ if "messages" not in st.session_state:
         {"role": "assistant", "content": "Hello! I'm your Hotel Knowledge Graph Assistant. You can ask me anything about hotels, their locations, facilities, and reviews. What would you like to know?"}
     ]
 
-# Initialize knowledge graph if not already done
-if "knowledge_graph_created" not in st.session_state:
-    with st.spinner("Initializing the knowledge graph..."):
-        create_knowledge_graph(sample_hotel_reviews)
-        st.session_state.knowledge_graph_created = True
+# Initialize the knowledge graph once per process; all sessions share the result
+@st.cache_resource(show_spinner="Initializing the knowledge graph...")
+def init_knowledge_graph():
+    get_default_engine().driver.verify_connectivity()
+    return ensure_knowledge_graph(sample_hotel_reviews)
+
+init_knowledge_graph()
 
 # Sidebar with app information
 with st.sidebar:
@@ -128,13 +130,21 @@ if prompt := st.chat_input("Ask me about hotels..."):
         message_placeholder = st.empty()
         full_response = ""
         
-        # Get response from RAG model
-        with st.spinner("Searching the knowledge graph..."):
-            try:
-                response = rag_query(prompt)
-                full_response = response
-            except Exception as e:
-                full_response = f"Sorry, I encountered an error: {str(e)}"
+        # Stream the response from the RAG model as it is generated
+        status = st.status("Searching the knowledge graph...")
+        try:
+            for event, text in rag_query_stream(prompt):
+                if event == "cypher":
+                    status.code(text, language="cypher")
+                elif event == "status":
+                    status.update(label=text)
+                else:
+                    full_response += text
+                    message_placeholder.markdown(full_response + "▌")
+            status.update(label="Knowledge graph searched", state="complete", expanded=False)
+        except Exception as e:
+            status.update(label="Search failed", state="error", expanded=False)
+            full_response = f"Sorry, I encountered an error: {str(e)}"
         
         # Display the response
         message_placeholder.markdown(full_response)
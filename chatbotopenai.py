@@ -6,6 +6,11 @@
 
 from openai import OpenAI
 import streamlit as st
+import threading
+import time
+import re
+from collections import OrderedDict
+import numpy as np
 
 
 # In[ ]:
@@ -19,14 +24,207 @@ os.getcwd()
 # In[3]:
 
 
-f = open("keys/openaiapikey.txt")
-OPENAI_API_KEY=f.read()
+#read the key and build the client once per process; reruns and other sessions reuse it
+@st.cache_resource
+def get_openai_client():
+    with open("keys/openaiapikey.txt") as f:
+        OPENAI_API_KEY=f.read().strip()
+    return OpenAI(api_key=OPENAI_API_KEY)
 
 
 # In[4]:
 
 
-model= OpenAI(api_key=OPENAI_API_KEY)
+model= get_openai_client()
+
+
+# In[5]:
+
+
+#bounded conversation memory: recent turns within a token budget + a rolling summary of older turns
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+class ConversationMemory:
+    """Keep the prompt size flat however long the conversation runs.
+
+    Recent messages are kept verbatim up to `token_budget`. Every `summarize_every`
+    turns, messages that fell out of that window are folded into a rolling summary
+    by a background thread, so the user never waits on summarization.
+    """
+
+    def __init__(self, client, token_budget=1500, summarize_every=6, model="gpt-4o-mini"):
+        self.client = client
+        self.token_budget = token_budget
+        self.summarize_every = summarize_every
+        self.model = model
+        self.messages = []
+        self.summary = ""
+        self.facts = {}
+        self.turns_since_summary = 0
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def add(self, role, content):
+        with self._lock:
+            self.messages.append({"role": role, "content": content})
+            if role == "user":
+                self.turns_since_summary += 1
+        if self.turns_since_summary >= self.summarize_every:
+            self._summarize_in_background()
+
+    def _window_start(self):
+        # index of the oldest message that still fits in the token budget;
+        # the newest message is always kept, the budget decides how many older turns join it
+        if not self.messages:
+            return 0
+        used = estimate_tokens(self.messages[-1]["content"])
+        for i in range(len(self.messages) - 2, -1, -1):
+            used += estimate_tokens(self.messages[i]["content"])
+            if used > self.token_budget:
+                return i + 1
+        return 0
+
+    def context_messages(self):
+        with self._lock:
+            window = self.messages[self._window_start():]
+            summary = self.summary
+        #a single message over the whole budget is truncated rather than dropped, so the model still sees the question
+        if window and estimate_tokens(window[-1]["content"]) > self.token_budget:
+            window = window[:-1] + [{**window[-1], "content": window[-1]["content"][:self.token_budget * 4]}]
+        if summary:
+            return [{"role": "system", "content": f"Summary of the earlier conversation: {summary}"}] + window
+        return window
+
+    def _summarize_in_background(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            older = self.messages[:self._window_start()]
+            self.turns_since_summary = 0
+        if not older:
+            return
+        self._worker = threading.Thread(target=self._summarize, args=(older,), daemon=True)
+        self._worker.start()
+
+    def _summarize(self, older):
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in older)
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "system", "content": "Update the running summary of a counselling chat "
+                           "with the new messages. Keep names, goals, courses and open questions. "
+                           "Reply with the summary only, at most 150 words."},
+                          {"role": "user", "content": f"Current summary: {self.summary or 'none'}\n\nNew messages:\n{transcript}"}])
+        except Exception:
+            return
+        with self._lock:
+            self.summary = response.choices[0].message.content
+            # summarized messages are no longer needed in the prompt
+            del self.messages[:len(older)]
+
+
+#semantic FAQ cache: repeated questions ("course fees?", "placement support?") are answered without calling the model
+class SemanticCache:
+    """In-memory nearest-neighbour cache from question embeddings to answers.
+
+    Entries expire after `ttl_seconds`, the least recently used entry is evicted
+    once `max_entries` is reached, and hit/miss counts are kept for `stats()`.
+    """
+
+    def __init__(self, client, threshold=0.92, ttl_seconds=24 * 3600, max_entries=500,
+                 embedding_model="text-embedding-3-small"):
+        self.client = client
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.embedding_model = embedding_model
+        self.entries = OrderedDict()  # normalized question -> (embedding, answer, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self._matrix = None
+        self._keys = []
+        self._lock = threading.Lock()
+
+    #words that point back to earlier turns or at the user, so the question does not stand on its own
+    REFERENCE_WORDS = {"it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "him",
+                       "his", "she", "her", "above", "earlier", "previous", "again", "same", "else",
+                       "my", "me", "mine"}
+
+    @staticmethod
+    def normalize(question):
+        #\w keeps letters and digits of every script; casefold also matches case variants outside ASCII
+        return " ".join(re.findall(r"\w+", question.casefold()))
+
+    @classmethod
+    def is_cacheable(cls, question):
+        """True if the answer depends on the question alone: it has words, at least three of them,
+        and none that refer back to the conversation or to the user."""
+        words = cls.normalize(question).split()
+        return len(words) >= 3 and not cls.REFERENCE_WORDS.intersection(words)
+
+    def embed(self, text):
+        vector = np.asarray(
+            self.client.embeddings.create(model=self.embedding_model, input=[text]).data[0].embedding,
+            dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _drop_expired(self, now):
+        expired = [key for key, (_, _, expires_at) in self.entries.items() if expires_at <= now]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, question):
+        """Return (answer or None, embedding); the embedding can be passed back to store()."""
+        key = self.normalize(question)
+        now = time.time()
+        with self._lock:
+            self._drop_expired(now)
+            #exact match after normalization needs no embedding call
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][1], self.entries[key][0]
+        embedding = self.embed(key)
+        with self._lock:
+            if self.entries:
+                if self._matrix is None:
+                    self._keys = list(self.entries)
+                    self._matrix = np.vstack([self.entries[k][0] for k in self._keys])
+                scores = self._matrix @ embedding
+                best = int(scores.argmax())
+                if scores[best] >= self.threshold and self._keys[best] in self.entries:
+                    self.entries.move_to_end(self._keys[best])
+                    self.hits += 1
+                    return self.entries[self._keys[best]][1], embedding
+            self.misses += 1
+        return None, embedding
+
+    def store(self, question, answer, embedding=None):
+        key = self.normalize(question)
+        if embedding is None:
+            embedding = self.embed(key)
+        with self._lock:
+            self.entries[key] = (embedding, answer, time.time() + self.ttl_seconds)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / total if total else 0.0}
+
+
+#one cache per process, shared by every session
+@st.cache_resource
+def get_faq_cache():
+    return SemanticCache(get_openai_client())
 
 
 # In[6]:
@@ -38,7 +236,7 @@ st.title("My First AI chatbot")
 if "messages" not in st.session_state:
     st.session_state["messages"] = []
 if "memory" not in st.session_state:
-    st.session_state["memory"] = []
+    st.session_state["memory"] = ConversationMemory(model)
 
 st.chat_message("assistant").write("Hi,how can I help you?")
 
@@ -49,27 +247,58 @@ user_input = st.chat_input()
 
 if user_input:
     # add user input to memory for context retention (eg :when we use chat gpt we prefer chatgpt to have memory of previous questions when we ask many subquestions for one question itself )
+    st.chat_message("user").write(user_input)
     st.session_state["messages"].append({"role":"user","content":user_input})
-    if "my name is" in user_input.lower():
-        name=user_input.split("my name is")[-1].strip().split([0])
-        st.session_state["memory"]["name"] = name
+    memory = st.session_state["memory"]
+    memory.add("user", user_input)
+    response_text = cached_answer = faq_cache = None
+    name_words = user_input.lower().split("my name is")[-1].split() if "my name is" in user_input.lower() else []
+    if name_words:
+        name=name_words[0].title()
+        memory.facts["name"] = name
         response_text = f"Nice to meet you,{name}!"
-    else:
-        # include memory in system prompt
-        memory_content = (
-            f"User's name is {st.session_state['memory'].get('name','Unknown')}"
-            if "name" in st.session_state['memory'] else ""
-        )
+    elif SemanticCache.is_cacheable(user_input):
+        #the cache is keyed on the question alone, so it is only used for questions that stand on their own
+        #(at any turn); follow-ups like "what about its fees?" still go to the model with the conversation
+        faq_cache = get_faq_cache()
+        cached_answer, question_embedding = faq_cache.lookup(user_input)
+    if response_text is None and cached_answer is None:
+        if faq_cache is not None:
+            #a cached answer is shared by every session, so it is generated from the question alone,
+            #without the user's name or earlier turns
+            memory_content = ""
+            context = [{"role": "user", "content": user_input}]
+        else:
+            # include memory in system prompt
+            memory_content = (
+                f"User's name is {memory.facts['name']}"
+                if "name" in memory.facts else ""
+            )
+            # only the rolling summary and the recent window are sent, so the prompt stays bounded
+            context = memory.context_messages()
         response = model.chat.completions.create(
                    model='gpt-4o-mini', messages= [{'role':'system',
                    "content":f"""You are a professional educational
                    counsellor working in a data science Institute called "Learnbay".If someone asks your name,tell them politely that your name is "Learnbay soldier".{memory_content}"""}]+
-                   st.session_state['messages'] + [{'role':'system',
-                   "content":user_input}]
+                   context,
+                   stream=True
                            )
-        response_text = response.choices[0].message.content     
+    elif cached_answer is not None:
+        response_text = cached_answer
 
-    st.chat_message("assistant").write(response_text)
-    st.session_state["messages"].append({"role":"user","content":user_input})
-    st.session_state["memory"].append({"role":"user","content":user_input})
+    with st.chat_message("assistant"):
+        if response_text is None:
+            #show tokens as they arrive; write_stream returns the full text
+            response_text = st.write_stream(
+                chunk.choices[0].delta.content
+                for chunk in response
+                if chunk.choices and chunk.choices[0].delta.content
+            )
+            if faq_cache is not None:
+                faq_cache.store(user_input, response_text, question_embedding)
+        else:
+            st.write(response_text)
+    st.session_state["messages"].append({"role":"assistant","content":response_text})
+    memory.add("assistant", response_text)
 
+st.sidebar.caption("FAQ cache: {entries} entries, hit rate {hit_rate:.0%}".format(**get_faq_cache().stats()))
@@ -3,9 +3,17 @@ Graph RAG with Neo4j and OpenAI - Complete Implementation
 """
 
 import os
+import re
+import sys
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from openai import OpenAI
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, Query, READ_ACCESS
 import pandas as pd
 import numpy as np
 import dash
@@ -27,8 +35,6 @@ def _create_openai_client():
         raise RuntimeError(f"Failed to read OpenAI API key from {key_file_path}: {e}")
     return OpenAI(api_key=api_key)
 
-openai_client = _create_openai_client()
-
 # Helper to safely obtain Neo4j URI
 def _get_neo4j_uri():
     uri = os.getenv("NEO4J_URI", "").strip()
@@ -37,110 +43,64 @@ def _get_neo4j_uri():
         uri = "neo4j+s://9a000976.databases.neo4j.io"
     return uri
 
-# Initialize lists to store data
-ontology_list = []
-node_creation_cypher_list = []
+# Limits applied to generated Cypher on the read path
+CYPHER_RESULT_LIMIT = int(os.getenv("CYPHER_RESULT_LIMIT", "200"))
+CYPHER_MAX_ESTIMATED_ROWS = float(os.getenv("CYPHER_MAX_ESTIMATED_ROWS", "100000"))
+CYPHER_TIMEOUT_SECONDS = float(os.getenv("CYPHER_TIMEOUT_SECONDS", "10"))
+CYPHER_MAX_ATTEMPTS = int(os.getenv("CYPHER_MAX_ATTEMPTS", "3"))
 
-# Function to identify relationships and nodes
-def identify_relationships_and_nodes(file_text):
-    
-    system_prompt = f"""Assistant is a Named Entity Recognition (NER) expert. The assistant can identify named entities 
-    such as a person, place, or thing. The assistant can also identify entity relationships, which describe
-    how entities relate to each other (eg: married to, located in, held by). Identify the named entities
-    and the entity relationships present in the text by returning comma separated list of tuples
-    representing the relationship between two entities in the format (entity, relationship, entity). Only
-    generate tuples from the list of entities and the possible entity relationships listed below. Return
-    only generated tuples in a comma separated tuple separated by a new line for each tuple.
-
-    Entities:
-    - Hotel
-    - Location
-    - Facilities
-    - CustomerType
-    - Reviewer
-
-    Relationships:
-    - [Hotel],is_located_in,[Location]
-    - [Hotel],has_facilities,[Facilities]
-    - [Hotel],has_customers,[CustomerType]
-    - [Hotel],has_reviewer,[Reviewer]
-
-    Example Output:
-    Creek Hotel,is_located_in,Dubai
-    Creek Hotel,has_facilities,swimming pool
-    Creek Hotel,has_customers,Businessmen
-    Creek Hotel,has_customers,senior citizens
-    Creek Hotel,has_reviewer,John Doe
+# Default token budget for the graph context passed to the answer prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
 
-    """
+# Token budget for the reviews packed into one extraction request
+EXTRACTION_PACK_TOKEN_BUDGET = int(os.getenv("EXTRACTION_PACK_TOKEN_BUDGET", "3000"))
+EXTRACTION_PACK_MAX_REVIEWS = int(os.getenv("EXTRACTION_PACK_MAX_REVIEWS", "40"))
 
-    user_prompt = f"""Identify the named entities and entity relationships in the hotel review text above. Return the
-    entities and entity relationships in a tuple separated by commas. Return only generated tuples in a
-    comma separated tuple separated by a new line for each tuple.
+_PACKED_TUPLE_PATTERN = re.compile(r"^\[?R(\d+)\]?\s*,\s*([^,]+,[^,]+,.+)$")
 
-    Text: {file_text}"""
+# Embedding model and thresholds for the vector index over node names and reviews
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+ENTITY_MATCH_THRESHOLD = float(os.getenv("ENTITY_MATCH_THRESHOLD", "0.6"))
+VECTOR_TOP_K = int(os.getenv("VECTOR_TOP_K", "5"))
 
-    chat_completions_response = openai_client.chat.completions.create(
-        model = os.getenv("GPT_ENGINE"),
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        temperature=0
-    )
-    
-    ontology_list.append(chat_completions_response.choices[0].message.content)
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "of", "in", "at", "on", "to", "by", "for", "with",
+    "and", "or", "what", "which", "who", "whom", "where", "how", "does", "do", "did", "has", "have",
+    "this", "these", "that", "those", "there", "any", "all", "me", "tell", "about", "stay", "hotel", "hotels"
+}
 
-    print(chat_completions_response.choices[0].message.content)
-    return chat_completions_response.choices[0].message.content
+# Function to list the short word spans of a question that may name a graph entity
+def _candidate_mentions(user_query, max_words=3):
+    words = re.findall(r"[\w'-]+", user_query)
+    mentions = []
+    for size in range(1, max_words + 1):
+        for start in range(len(words) - size + 1):
+            span = words[start:start + size]
+            if span[0].lower() in _STOPWORDS or span[-1].lower() in _STOPWORDS:
+                continue
+            mentions.append(" ".join(span))
+    return list(dict.fromkeys(mentions))
 
-# Function to generate Cypher query for node creation
-def generate_cypher_for_node_creation(ontology_text):
-    cypher_system_prompt = f""" Assistant is an expert in Neo4j Cypher development. Create a cypher query to generate a graph using the data points provided. 
-    make sure to only include the cypher query in your response so that I can directly send this cypher query to the Neo4j database API endpoint
-    via a POST request. The data is in the format of a comma separated tuple separated by a new line for each tuple.
+# Labels written by create_knowledge_graph
+GRAPH_NODE_LABELS = ["Hotel", "Location", "Facilities", "CustomerType", "Reviewer"]
 
-    """
-    
-    cypher_user_prompt = f"""Generate a cypher query to create new nodes and their relationships given the data provided. Return only the cypher query. 
-    Data is composed of relationships between entities that have been extracted using NER.
-    The data is in the format of a comma separated tuple separated by a new line for each tuple.
-    
-    Example Input: 
-    Creek Hotel,is_located_in,Dubai
-    Creek Hotel,has_customers,businessmen
-    Creek Hotel,has_customers,tourists
-    Creek Hotel,has_reviewer,Ryouta Sato
-    Creeh Hotel,has_facilities,swimming pool
-
-    Example Output:
-    CREATE (ch:Hotel {{name: 'Creek Hotel'}})-[:is_located_in]->(d:Location {{name: 'Dubai'}}),
-        (ch)-[:has_customers]->(b:CustomerType {{name: 'businessmen'}}),
-        (ch)-[:has_customers]->(t:CustomerType {{name: 'tourists'}}),
-        (ch)-[:has_reviewer]->(rs:Reviewer {{name: 'Ryouta Sato'}}),
-        (ch)-[:has_facilities]->(sp:Facilities {{name: 'swimming pool'}})
-        
-    strictly stick to the above output format
-    
-    use distinct variable names for each node and relationship to avoid conflicts
+# Graph-side build lock: how long to wait for another process's build, and when its lock counts as abandoned
+GRAPH_BUILD_LOCK_TIMEOUT_SECONDS = float(os.getenv("GRAPH_BUILD_LOCK_TIMEOUT_SECONDS", "1800"))
+GRAPH_BUILD_LOCK_TTL_SECONDS = float(os.getenv("GRAPH_BUILD_LOCK_TTL_SECONDS", "3600"))
 
-    the data is: {ontology_text}
-
-    """
-    
-    cypher_query = openai_client.chat.completions.create(
-        model = os.getenv("GPT_ENGINE"),
-        messages = [
-            {"role": "system", "content": cypher_system_prompt},
-            {"role": "user", "content": cypher_user_prompt}
-        ],
-        temperature=0
-    )
-    
-    node_creation_cypher_list.append(cypher_query.choices[0].message.content)
+# Early, explainable rejection only; read-only is enforced by running in READ_ACCESS sessions
+_WRITE_CLAUSE_PATTERN = re.compile(
+    r"\b(CREATE|MERGE|DELETE|DETACH|SET|REMOVE|DROP|LOAD\s+CSV|FOREACH)\b|\bCALL\s+(dbms|apoc|gds)\."
+    r"|\bCALL\s+[\w.]*(create|drop|delete|remove|set|clear|await)\w*\s*\(",
+    re.IGNORECASE
+)
+_UNBOUNDED_PATH_PATTERN = re.compile(r"\[[^\]]*\*\s*(\d*\s*\.\.\s*)?\]")
+_LIMIT_PATTERN = re.compile(r"\bLIMIT\s+(\d+|\$\w+)\s*$", re.IGNORECASE)
+_UNION_PATTERN = re.compile(r"\bUNION(\s+ALL)?\b", re.IGNORECASE)
 
-    print(cypher_query.choices[0].message.content)
-    return cypher_query.choices[0].message.content
+# Raised when generated Cypher is unsafe or too expensive to run
+class CypherRejectedError(ValueError):
+    pass
 
 # Function to strip markdown code blocks from Cypher queries
 def strip_markdown_code_blocks(query):
@@ -152,156 +112,1204 @@ def strip_markdown_code_blocks(query):
         first_marker_end = query.find('\n', 3)
         if first_marker_end != -1:
             query = query[first_marker_end + 1:]
-    
+
     # Remove trailing code block markers
     if '```' in query:
         query = query.split('```')[0]
-    
+
     return query.strip()
 
-# Function to query Neo4j graph
-def query_neo4j_graph(user_query):
-    query_with_cypher_system_prompt = f"""Assistant is an expert in Neo4j Cypher development. Only return a cypher query based on the user query
-    the cypher graph has the following schema:
-
-    Nodes:
-    - Hotel
-    - Location
-    - Facilities
-    - CustomerType
-    - Reviewer
-
-    Relationships:
-    - [Hotel],is_located_in,[Location]
-    - [Hotel],has_facilities,[Facilities]
-    - [Hotel],has_customers,[CustomerType]
-    - [Hotel],has_reviewer,[Reviewer]
-
-    example of a node created through cypher query:
-    {node_creation_cypher_list[0] if node_creation_cypher_list else ""}
-    
-    Example Input:
-    what hotels are reviewed by Ryouta Sato?
-    
-    Example Output:
-    MATCH (h:Hotel)-[:has_reviewer]-(r:Reviewer {{name: 'Ryouta Sato'}})
-    RETURN h
+# Replace string literals and comments with same-length blanks so positions still line up with the query
+def _mask_literals_and_comments(query):
+    # One pass, so quotes inside comments and comment markers inside strings are left alone
+    def mask(match):
+        text = match.group(0)
+        if text[0] in "'\"":
+            return text[0] + " " * (len(text) - 2) + text[-1]
+        return re.sub(r"[^\n]", " ", text)
 
-    stick strictly to the above output format
-    """
+    return re.sub(
+        r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|//[^\n]*|/\*.*?(?:\*/|$)",
+        mask,
+        query,
+        flags=re.DOTALL
+    )
 
-    query_with_cypher_user_prompt = f"""Generate a cypher query to answer the user query.
-    user_query = {user_query}"""
-    
-    query_response = openai_client.chat.completions.create(
-        model = os.getenv("GPT_ENGINE"),
-        messages = [
-            {"role": "system", "content": query_with_cypher_system_prompt},
-            {"role": "user", "content": query_with_cypher_user_prompt}
-        ],
-        temperature=0
-    )    
-    
-    cypher_query_for_retrieval = query_response.choices[0].message.content
-    
-    print(cypher_query_for_retrieval)
-    
-    return cypher_query_for_retrieval
+# Add the default LIMIT to every UNION branch that has none
+def _enforce_limit(query, code_only):
+    branches = []
+    start = 0
+    for union in _UNION_PATTERN.finditer(code_only):
+        branches.append((start, union.start(), union.group(0)))
+        start = union.end()
+    branches.append((start, len(query), ""))
 
-# Function to execute Neo4j query and return results
-def execute_neo4j_query(cypher_query):
-    url = _get_neo4j_uri()
-    neo4j_username = os.getenv("NEO4J_USERNAME")
-    neo4j_password = os.getenv("NEO4J_PASSWORD")
-    
-    driver = GraphDatabase.driver(url, auth=(neo4j_username, neo4j_password))
-    
-    with driver.session() as session:
-        # Run the Cypher query
-        result = session.run(cypher_query)
-        
-        # Extract and return results
-        records = [record.data() for record in result]
-        print(records)
-        return records
+    parts = []
+    for begin, end, union in branches:
+        text = query[begin:end].strip()
+        if not _LIMIT_PATTERN.search(code_only[begin:end].rstrip()):
+            text = f"{text}\nLIMIT {CYPHER_RESULT_LIMIT}"
+        parts.append(f"{text}\n{union}\n" if union else text)
+    return "".join(parts)
 
-# Function to create the knowledge graph in Neo4j
-def create_knowledge_graph(hotel_reviews):
-    """
-    Create a knowledge graph in Neo4j from hotel reviews
-    
-    Args:
-        hotel_reviews: List of hotel review texts
-    """
-    # Process each hotel review
-    for review in hotel_reviews:
-        # Identify relationships and nodes
-        ontology = identify_relationships_and_nodes(review)
-        
-        # Generate Cypher query for node creation
-        cypher_query = generate_cypher_for_node_creation(ontology)
-    
-    # Connect to Neo4j and create the graph
-    url = _get_neo4j_uri()
-    neo4j_username = os.getenv("NEO4J_USERNAME")
-    neo4j_password = os.getenv("NEO4J_PASSWORD")
-    
-    driver = GraphDatabase.driver(url, auth=(neo4j_username, neo4j_password))
-    
-    with driver.session() as session:
-        for cypher_query in node_creation_cypher_list:
-            # Remove markdown code block markers
-            clean_query = strip_markdown_code_blocks(cypher_query)
-            try:
-                session.run(clean_query)
-                print(f"Executed: {clean_query}")
-            except Exception as e:
-                print(f"Error executing query: {e}")
-                print(f"Failed query: {clean_query}")
+# Walk an EXPLAIN plan and return (operator names, row estimate of the root operator)
+def _summarize_plan(plan):
+    # The root estimate is what the query returns after its LIMITs; inner operators such as
+    # a label scan under a LIMIT estimate rows that are never produced
+    arguments = plan.get("args") or plan.get("arguments") or {}
+    result_rows = float(arguments.get("EstimatedRows", 0))
+    operators = set()
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        operators.add(node.get("operatorType", "").split("@")[0])
+        stack.extend(node.get("children", []))
+    return operators, result_rows
+
+# Rough token estimate (about 4 characters per token for English text)
+def _estimate_tokens(text):
+    return len(text) // 4 + 1
+
+# Render a node or property value compactly
+def _format_graph_value(value):
+    if hasattr(value, "labels"):
+        value = dict(value)
+    if isinstance(value, dict):
+        name = value.get("name")
+        extra = ", ".join(f"{k}={v}" for k, v in sorted(value.items()) if k != "name")
+        if name is not None and extra:
+            return f"{name} ({extra})"
+        return str(name) if name is not None else extra
+    if isinstance(value, (list, tuple)):
+        return ", ".join(_format_graph_value(v) for v in value)
+    return str(value)
 
-# Function to perform RAG query
-def rag_query(user_query):
+# Find the hotel a record belongs to, either from a Hotel node or a hotel-named column
+def _record_hotel(items):
+    for key, value in items:
+        if hasattr(value, "labels") and "Hotel" in value.labels:
+            return key, _format_graph_value(value)
+    for key, value in items:
+        if "hotel" in key.lower() or key == "h":
+            return key, _format_graph_value(value)
+    return None, "Other"
+
+# Function to serialize graph results into a compact, token-budgeted context
+def serialize_graph_results(records, token_budget=None):
     """
-    Perform a RAG query using Neo4j and OpenAI
-    
+    Group graph records by hotel, dedupe repeated values and render compact text
+
     Args:
-        user_query: User's natural language query
-    
+        records: Iterable of neo4j Records or dicts, consumed lazily
+        token_budget: Maximum estimated tokens for the rendered context
+
     Returns:
-        Answer to the user's query
+        Compact text with one line per hotel and, if the budget ran out, a line with the
+        number of omitted results; the query's LIMIT keeps counting the rest cheap
     """
-    # Generate Cypher query from user query
-    cypher_query = query_neo4j_graph(user_query)
-    
-    # Clean the query
-    clean_query = strip_markdown_code_blocks(cypher_query)
-    
-    # Execute the query
-    results = execute_neo4j_query(clean_query)
-    
-    # Format the results for the LLM
-    formatted_results = str(results)
-    
-    # Generate answer using OpenAI
+    token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+    groups = {}
+    used_tokens = 0
+    omitted = 0
+
+    records = iter(records)
+    for record in records:
+        items = list(record.items()) if hasattr(record, "items") else list(dict(record).items())
+        hotel_key, hotel = _record_hotel(items)
+
+        # Only values not already seen for this hotel cost tokens
+        new_values = []
+        columns = groups.get(hotel, {})
+        for key, value in items:
+            if key == hotel_key:
+                continue
+            text = _format_graph_value(value)
+            if text and text not in columns.get(key, {}):
+                new_values.append((key, text))
+
+        cost = _estimate_tokens(hotel) if hotel not in groups else 0
+        cost += sum(_estimate_tokens(f"{key}: {text}, ") for key, text in new_values)
+        if used_tokens + cost > token_budget:
+            # Count this record and the rest without formatting them
+            omitted = 1 + sum(1 for _ in records)
+            break
+
+        used_tokens += cost
+        columns = groups.setdefault(hotel, {})
+        for key, text in new_values:
+            # dict keeps insertion order, used here as an ordered set
+            columns.setdefault(key, {})[text] = None
+
+    lines = []
+    for hotel, columns in groups.items():
+        fields = " | ".join(f"{key}: {', '.join(values)}" for key, values in columns.items())
+        lines.append(f"{hotel} | {fields}" if fields else hotel)
+    if omitted:
+        lines.append(f"... {omitted} more results omitted (token budget reached)")
+    return "\n".join(lines) if lines else "No results found."
+
+# Function to fingerprint a set of reviews for the graph-side version marker
+def knowledge_graph_version(hotel_reviews):
+    digest = hashlib.sha256()
+    for review in hotel_reviews:
+        digest.update(review.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+# Function to build the answer prompt from the graph context
+def _build_answer_messages(user_query, formatted_results):
     system_prompt = f"""You are an assistant that answers questions about hotels based on the provided information.
     Use only the information provided to answer the question. If you don't know the answer, say so.
     """
-    
+
     user_prompt = f"""Based on the following information about hotels, answer this question: {user_query}
-    
+
     Information: {formatted_results}
     """
-    
-    response = openai_client.chat.completions.create(
-        model = os.getenv("GPT_ENGINE"),
-        messages = [
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+class GraphRAGEngine:
+    """
+    Graph RAG pipeline over Neo4j and OpenAI with all state held on the instance.
+
+    The OpenAI client and Neo4j driver are thread-safe and shared by every call;
+    the mutable state (prompt examples, extracted ontologies, the Cypher cache)
+    is guarded by a lock, so one engine can serve many threads or asyncio tasks.
+    """
+
+    def __init__(self, openai_client=None, driver=None, model=None,
+                 max_prompt_examples=3, cypher_cache_size=256):
+        """
+        Args:
+            openai_client: OpenAI client, created from keys/openaiapikey.txt if not given
+            driver: Neo4j driver, created from the NEO4J_* environment variables if not given
+            model: Chat model name, defaults to the GPT_ENGINE environment variable
+            max_prompt_examples: Number of node-creation Cypher examples kept for prompts
+            cypher_cache_size: Number of question -> guarded Cypher entries kept in memory
+        """
+        self.openai_client = openai_client or _create_openai_client()
+        self.driver = driver or GraphDatabase.driver(
+            _get_neo4j_uri(), auth=(os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))
+        )
+        self.model = model or os.getenv("GPT_ENGINE")
+        self.ontologies = deque(maxlen=max_prompt_examples)
+        self.cypher_examples = deque(maxlen=max_prompt_examples)
+        self.cypher_cache_size = cypher_cache_size
+        self._cypher_cache = OrderedDict()
+        self._entity_names = None
+        self._embedding_cache = {}
+        self._node_index = None
+        self._review_index = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.driver.close()
+
+    def _chat(self, messages, temperature=0, stream=False):
+        return self.openai_client.chat.completions.create(
+            model = self.model,
+            messages = messages,
+            temperature=temperature,
+            stream=stream
+        )
+
+    # Function to identify relationships and nodes
+    def identify_relationships_and_nodes(self, file_text):
+        ontology = self._extract_single(file_text)
+
+        with self._lock:
+            self.ontologies.append(ontology)
+
+        print(ontology)
+        return ontology
+
+    # Function to extract the tuples of one review without recording them
+    def _extract_single(self, file_text):
+
+        system_prompt = f"""Assistant is a Named Entity Recognition (NER) expert. The assistant can identify named entities
+        such as a person, place, or thing. The assistant can also identify entity relationships, which describe
+        how entities relate to each other (eg: married to, located in, held by). Identify the named entities
+        and the entity relationships present in the text by returning comma separated list of tuples
+        representing the relationship between two entities in the format (entity, relationship, entity). Only
+        generate tuples from the list of entities and the possible entity relationships listed below. Return
+        only generated tuples in a comma separated tuple separated by a new line for each tuple.
+
+        Entities:
+        - Hotel
+        - Location
+        - Facilities
+        - CustomerType
+        - Reviewer
+
+        Relationships:
+        - [Hotel],is_located_in,[Location]
+        - [Hotel],has_facilities,[Facilities]
+        - [Hotel],has_customers,[CustomerType]
+        - [Hotel],has_reviewer,[Reviewer]
+
+        Example Output:
+        Creek Hotel,is_located_in,Dubai
+        Creek Hotel,has_facilities,swimming pool
+        Creek Hotel,has_customers,Businessmen
+        Creek Hotel,has_customers,senior citizens
+        Creek Hotel,has_reviewer,John Doe
+
+        """
+
+        user_prompt = f"""Identify the named entities and entity relationships in the hotel review text above. Return the
+        entities and entity relationships in a tuple separated by commas. Return only generated tuples in a
+        comma separated tuple separated by a new line for each tuple.
+
+        Text: {file_text}"""
+
+        chat_completions_response = self._chat([
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
-        ],
-        temperature=0.7
-    )
-    
-    return response.choices[0].message.content
+        ])
+        return chat_completions_response.choices[0].message.content
+
+    # Function to split reviews into packs that fit the extraction token budget
+    @staticmethod
+    def _pack_reviews(review_ids, reviews, token_budget, max_reviews):
+        packs = []
+        current = []
+        used_tokens = 0
+        for review_id in review_ids:
+            cost = _estimate_tokens(reviews[review_id]) + 4
+            if current and (used_tokens + cost > token_budget or len(current) >= max_reviews):
+                packs.append(current)
+                current = []
+                used_tokens = 0
+            current.append(review_id)
+            used_tokens += cost
+        if current:
+            packs.append(current)
+        return packs
+
+    # Function to extract tuples for many reviews in one request
+    def _extract_pack(self, pack, reviews):
+        system_prompt = f"""Assistant is a Named Entity Recognition (NER) expert. You will receive several hotel
+        reviews, each prefixed with its id in square brackets, e.g. [R3]. For every review, identify the named
+        entities and the entity relationships and return one tuple per line in the format
+        review_id,entity,relationship,entity. Only generate tuples from the entities and relationships listed
+        below and only from the text of the review with that id. Return only the tuples.
+
+        Entities:
+        - Hotel
+        - Location
+        - Facilities
+        - CustomerType
+        - Reviewer
+
+        Relationships:
+        - [Hotel],is_located_in,[Location]
+        - [Hotel],has_facilities,[Facilities]
+        - [Hotel],has_customers,[CustomerType]
+        - [Hotel],has_reviewer,[Reviewer]
+
+        Example Output:
+        R1,Creek Hotel,is_located_in,Dubai
+        R1,Creek Hotel,has_customers,Businessmen
+        R2,Deira Hotel,has_reviewer,John Doe
+        """
+
+        user_prompt = "\n\n".join(f"[R{review_id}] {reviews[review_id]}" for review_id in pack)
+
+        response = self._chat([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ])
+        content = strip_markdown_code_blocks(response.choices[0].message.content)
+
+        tuples = {review_id: [] for review_id in pack}
+        for line in content.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            match = _PACKED_TUPLE_PATTERN.match(line)
+            if not match or int(match.group(1)) not in tuples:
+                raise ValueError(f"Unparseable extraction line: {line}")
+            tuples[int(match.group(1))].append(match.group(2).strip())
+        return {review_id: "\n".join(lines) for review_id, lines in tuples.items()}
+
+    # Function to identify relationships and nodes for many reviews with packed requests
+    def identify_relationships_for_reviews(self, reviews, token_budget=None, max_reviews=None):
+        """
+        Extract (entity, relationship, entity) tuples for many reviews, packing as many
+        reviews into one request as the token budget allows. A pack whose output does
+        not parse is split in half and retried, and reviews the model left out of a pack's
+        output are retried on their own; a single review that still fails or comes back
+        empty falls back to a one-review extraction request.
+
+        Args:
+            reviews: List of review texts
+            token_budget: Estimated review tokens per request
+            max_reviews: Maximum reviews per request
+
+        Returns:
+            List of ontology texts (one tuple per line), aligned with reviews
+        """
+        reviews = list(reviews)
+        pending = self._pack_reviews(
+            range(len(reviews)), reviews,
+            token_budget or EXTRACTION_PACK_TOKEN_BUDGET,
+            max_reviews or EXTRACTION_PACK_MAX_REVIEWS
+        )
+        ontologies = {}
+        calls = 0
+
+        while pending:
+            pack = pending.pop()
+            calls += 1
+            try:
+                extracted = self._extract_pack(pack, reviews)
+            except ValueError as e:
+                print(f"Pack of {len(pack)} reviews failed to parse, splitting: {e}")
+                if len(pack) == 1:
+                    calls += 1
+                    ontologies[pack[0]] = self._extract_single(reviews[pack[0]])
+                else:
+                    middle = len(pack) // 2
+                    pending.extend([pack[:middle], pack[middle:]])
+                continue
+
+            missing = [review_id for review_id in pack if not extracted[review_id]]
+            ontologies.update((review_id, text) for review_id, text in extracted.items() if text)
+            if missing and len(pack) == 1:
+                calls += 1
+                ontologies[pack[0]] = self._extract_single(reviews[pack[0]])
+            elif missing:
+                print(f"Pack of {len(pack)} reviews returned nothing for R{', R'.join(map(str, missing))}, retrying them alone")
+                pending.extend([review_id] for review_id in missing)
+
+        with self._lock:
+            self.ontologies.extend(ontologies[i] for i in range(len(reviews)))
+
+        print(f"Extracted {len(reviews)} reviews with {calls} packed requests")
+        return [ontologies[i] for i in range(len(reviews))]
+
+    # Function to generate Cypher query for node creation
+    def generate_cypher_for_node_creation(self, ontology_text):
+        cypher_system_prompt = f""" Assistant is an expert in Neo4j Cypher development. Create a cypher query to generate a graph using the data points provided.
+        make sure to only include the cypher query in your response so that I can directly send this cypher query to the Neo4j database API endpoint
+        via a POST request. The data is in the format of a comma separated tuple separated by a new line for each tuple.
+
+        """
+
+        cypher_user_prompt = f"""Generate a cypher query to create new nodes and their relationships given the data provided. Return only the cypher query.
+        Data is composed of relationships between entities that have been extracted using NER.
+        The data is in the format of a comma separated tuple separated by a new line for each tuple.
+
+        Example Input:
+        Creek Hotel,is_located_in,Dubai
+        Creek Hotel,has_customers,businessmen
+        Creek Hotel,has_customers,tourists
+        Creek Hotel,has_reviewer,Ryouta Sato
+        Creeh Hotel,has_facilities,swimming pool
+
+        Example Output:
+        CREATE (ch:Hotel {{name: 'Creek Hotel'}})-[:is_located_in]->(d:Location {{name: 'Dubai'}}),
+            (ch)-[:has_customers]->(b:CustomerType {{name: 'businessmen'}}),
+            (ch)-[:has_customers]->(t:CustomerType {{name: 'tourists'}}),
+            (ch)-[:has_reviewer]->(rs:Reviewer {{name: 'Ryouta Sato'}}),
+            (ch)-[:has_facilities]->(sp:Facilities {{name: 'swimming pool'}})
+
+        strictly stick to the above output format
+
+        use distinct variable names for each node and relationship to avoid conflicts
+
+        the data is: {ontology_text}
+
+        """
+
+        response = self._chat([
+            {"role": "system", "content": cypher_system_prompt},
+            {"role": "user", "content": cypher_user_prompt}
+        ])
+        cypher_query = response.choices[0].message.content
+
+        with self._lock:
+            self.cypher_examples.append(cypher_query)
+
+        print(cypher_query)
+        return cypher_query
+
+    # Function to query Neo4j graph
+    def query_neo4j_graph(self, user_query, feedback=None, entity_hints=None):
+        with self._lock:
+            cypher_example = self.cypher_examples[0] if self.cypher_examples else ""
+
+        query_with_cypher_system_prompt = f"""Assistant is an expert in Neo4j Cypher development. Only return a cypher query based on the user query
+        the cypher graph has the following schema:
+
+        Nodes:
+        - Hotel
+        - Location
+        - Facilities
+        - CustomerType
+        - Reviewer
+
+        Relationships:
+        - [Hotel],is_located_in,[Location]
+        - [Hotel],has_facilities,[Facilities]
+        - [Hotel],has_customers,[CustomerType]
+        - [Hotel],has_reviewer,[Reviewer]
+
+        example of a node created through cypher query:
+        {cypher_example}
+
+        Example Input:
+        what hotels are reviewed by Ryouta Sato?
+
+        Example Output:
+        MATCH (h:Hotel)-[:has_reviewer]-(r:Reviewer {{name: 'Ryouta Sato'}})
+        RETURN h
+
+        stick strictly to the above output format
+        """
+
+        query_with_cypher_user_prompt = f"""Generate a cypher query to answer the user query.
+        user_query = {user_query}"""
+
+        # Graph nodes matched to the question by the vector index, with their exact stored names
+        if entity_hints:
+            hints = "\n".join(f"- {hint['label']} {{name: '{hint['name']}'}}" for hint in entity_hints)
+            query_with_cypher_user_prompt += f"""
+
+        The question refers to these existing nodes; use their exact names:
+        {hints}"""
+
+        # Feedback from the Cypher guard about a previously rejected query
+        if feedback:
+            query_with_cypher_user_prompt += f"""
+
+        A previous attempt was rejected: {feedback}
+        Generate a corrected read-only query that avoids this problem."""
+
+        query_response = self._chat([
+            {"role": "system", "content": query_with_cypher_system_prompt},
+            {"role": "user", "content": query_with_cypher_user_prompt}
+        ])
+
+        cypher_query_for_retrieval = query_response.choices[0].message.content
+
+        print(cypher_query_for_retrieval)
+
+        return cypher_query_for_retrieval
+
+    # Function to execute Neo4j query and return results
+    def execute_neo4j_query(self, cypher_query):
+        with self.driver.session() as session:
+            # Run the Cypher query
+            result = session.run(cypher_query)
+
+            # Extract and return results
+            records = [record.data() for record in result]
+            print(records)
+            return records
+
+    # Function to stream Neo4j records without materializing the full result
+    def stream_neo4j_query(self, cypher_query, timeout=None):
+        """
+        Run a Cypher query and yield records one at a time while the session is open
+
+        Args:
+            cypher_query: Cypher statement to run
+            timeout: Server-side transaction timeout in seconds
+        """
+        # READ_ACCESS: the server rejects any write, whatever the query text looks like
+        with self.driver.session(default_access_mode=READ_ACCESS) as session:
+            for record in session.run(Query(cypher_query, timeout=timeout)):
+                yield record
+
+    # Function to validate generated Cypher before it reaches the database
+    def guard_cypher_query(self, cypher_query):
+        """
+        Reject write clauses and expensive plans and enforce a LIMIT
+
+        Args:
+            cypher_query: Cleaned Cypher statement produced by the LLM
+
+        Returns:
+            The statement to run, with a LIMIT added if it had none
+
+        Raises:
+            CypherRejectedError: With a message that can be fed back to the LLM
+        """
+        query = cypher_query.strip().rstrip(";").strip()
+        # Ignore string literals and comments so names such as 'Sunset Hotel' or a commented-out
+        # LIMIT do not trip (or satisfy) the checks
+        code_only = _mask_literals_and_comments(query)
+
+        write_clause = _WRITE_CLAUSE_PATTERN.search(code_only)
+        if write_clause:
+            raise CypherRejectedError(f"write clause '{write_clause.group(0)}' is not allowed on the read path")
+        if _UNBOUNDED_PATH_PATTERN.search(code_only):
+            raise CypherRejectedError("variable-length paths must have an upper bound, e.g. [*1..3]")
+
+        # Every UNION branch gets its own LIMIT
+        query = _enforce_limit(query, code_only)
+
+        # EXPLAIN validates syntax and returns the planner's estimate without running the query;
+        # a READ_ACCESS session also makes the server refuse write procedures the regex cannot see
+        with self.driver.session(default_access_mode=READ_ACCESS) as session:
+            try:
+                plan = session.run(Query(f"EXPLAIN {query}", timeout=CYPHER_TIMEOUT_SECONDS)).consume().plan
+            except Exception as e:
+                raise CypherRejectedError(f"the query failed to compile: {e}") from e
+
+        operators, result_rows = _summarize_plan(plan or {})
+        if "CartesianProduct" in operators:
+            raise CypherRejectedError("the plan contains a Cartesian product; connect all MATCH patterns")
+        if result_rows > CYPHER_MAX_ESTIMATED_ROWS:
+            raise CypherRejectedError(
+                f"the planner estimates {result_rows:.0f} rows, above the limit of {CYPHER_MAX_ESTIMATED_ROWS:.0f}"
+            )
+        return query
+
+    # Function to generate Cypher and retry with the guard's feedback until it passes
+    def generate_guarded_cypher(self, user_query, max_attempts=None, entity_hints=None):
+        """
+        Generate a Cypher query for the user query that passes guard_cypher_query.
+        Accepted queries are cached per normalized question.
+
+        Args:
+            entity_hints: Matches from resolve_entities, resolved here when not given
+
+        Raises:
+            CypherRejectedError: If no acceptable query was produced within max_attempts
+        """
+        cache_key = " ".join(user_query.lower().split())
+        with self._lock:
+            if cache_key in self._cypher_cache:
+                self._cypher_cache.move_to_end(cache_key)
+                return self._cypher_cache[cache_key]
+
+        if entity_hints is None:
+            entity_hints = self.resolve_entities(user_query)
+        feedback = None
+        for _ in range(max_attempts or CYPHER_MAX_ATTEMPTS):
+            cypher_query = strip_markdown_code_blocks(self.query_neo4j_graph(user_query, feedback, entity_hints))
+            try:
+                guarded_query = self.guard_cypher_query(cypher_query)
+            except CypherRejectedError as e:
+                print(f"Rejected query: {cypher_query}\nReason: {e}")
+                feedback = f"{e}. Query was: {cypher_query}"
+                continue
+
+            with self._lock:
+                self._cypher_cache[cache_key] = guarded_query
+                if len(self._cypher_cache) > self.cypher_cache_size:
+                    self._cypher_cache.popitem(last=False)
+            return guarded_query
+        raise CypherRejectedError(f"could not generate a safe query: {feedback}")
+
+    # Function to create the knowledge graph in Neo4j
+    def create_knowledge_graph(self, hotel_reviews):
+        """
+        Create a knowledge graph in Neo4j from hotel reviews
+
+        Args:
+            hotel_reviews: List of hotel review texts
+
+        Returns:
+            Number of reviews and Cypher queries that could not be loaded
+        """
+        # Identify relationships and nodes for all reviews with packed requests
+        ontologies = self.identify_relationships_for_reviews(hotel_reviews)
+        failed = sum(1 for ontology in ontologies if not ontology)
+
+        # Generate Cypher query for node creation
+        cypher_queries = [
+            self.generate_cypher_for_node_creation(ontology)
+            for ontology in ontologies
+            if ontology
+        ]
+
+        # Create the graph
+        with self.driver.session() as session:
+            for cypher_query in cypher_queries:
+                # Remove markdown code block markers
+                clean_query = strip_markdown_code_blocks(cypher_query)
+                try:
+                    session.run(clean_query).consume()
+                    print(f"Executed: {clean_query}")
+                except Exception as e:
+                    failed += 1
+                    print(f"Error executing query: {e}")
+                    print(f"Failed query: {clean_query}")
+        return failed
+
+    # Function to read the version recorded by the (:GraphMeta) marker of a graph
+    def _graph_version(self, name):
+        with self.driver.session() as session:
+            current = session.run(
+                "MATCH (m:GraphMeta {name: $name}) RETURN m.version AS version", name=name
+            ).single()
+        return current["version"] if current else None
+
+    # Function to take the graph-side build lock, waiting while another process holds it
+    def _acquire_build_lock(self, name, owner, timeout=None, poll_seconds=2.0):
+        """
+        The lock is a (:GraphBuildLock {name}) node under a uniqueness constraint, so
+        concurrent MERGEs from several processes create it once and only one owner wins.
+        A lock older than GRAPH_BUILD_LOCK_TTL_SECONDS was left by a crashed build and is taken over.
+
+        Raises:
+            TimeoutError: If the lock is still held by another owner after timeout seconds
+        """
+        with self.driver.session() as session:
+            session.run(
+                "CREATE CONSTRAINT graph_build_lock_name IF NOT EXISTS "
+                "FOR (l:GraphBuildLock) REQUIRE l.name IS UNIQUE"
+            ).consume()
+        deadline = time.monotonic() + (timeout or GRAPH_BUILD_LOCK_TIMEOUT_SECONDS)
+        while True:
+            with self.driver.session() as session:
+                acquired = session.run(
+                    """MERGE (l:GraphBuildLock {name: $name})
+                    ON CREATE SET l.owner = $owner, l.acquired_at = datetime()
+                    WITH l
+                    FOREACH (_ IN CASE WHEN l.owner <> $owner
+                                        AND l.acquired_at < datetime() - duration({seconds: $ttl})
+                                       THEN [1] ELSE [] END |
+                        SET l.owner = $owner, l.acquired_at = datetime())
+                    RETURN l.owner = $owner AS acquired""",
+                    name=name, owner=owner, ttl=int(GRAPH_BUILD_LOCK_TTL_SECONDS)
+                ).single()["acquired"]
+            if acquired:
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"graph '{name}' is still being built by another process")
+            print(f"Graph '{name}' is being built by another process, waiting...")
+            time.sleep(poll_seconds)
+
+    def _release_build_lock(self, name, owner):
+        with self.driver.session() as session:
+            session.run("MATCH (l:GraphBuildLock {name: $name, owner: $owner}) DELETE l",
+                        name=name, owner=owner).consume()
+
+    # Function to create the knowledge graph only if it is missing or out of date
+    def ensure_knowledge_graph(self, hotel_reviews, name="hotel_reviews"):
+        """
+        Check the (:GraphMeta) marker node and ingest only when its version does not
+        match the given reviews, so repeated startups neither re-call the LLM nor
+        duplicate nodes. The build runs under a graph-side lock, so processes starting
+        together build once, and the marker is written only after every review and
+        query loaded; a partial build is rebuilt on the next start.
+
+        Args:
+            hotel_reviews: List of hotel review texts
+            name: Name of the graph and its marker, one per ingested dataset; nodes
+                are tagged with it in their `graph` property
+
+        Returns:
+            True if the graph was (re)built, False if it was already up to date
+        """
+        version = knowledge_graph_version(hotel_reviews)
+        if self._graph_version(name) == version:
+            self.build_vector_index(hotel_reviews)
+            return False
+
+        owner = f"{os.getpid()}-{threading.get_ident()}-{time.time_ns()}"
+        self._acquire_build_lock(name, owner)
+        try:
+            # Another process may have finished the same build while this one waited
+            if self._graph_version(name) == version:
+                self.build_vector_index(hotel_reviews)
+                return False
+
+            with self.driver.session() as session:
+                # Out-of-date graph of this name, or untagged nodes written before markers existed
+                # (possibly duplicated by per-session ingestion); other named graphs are kept
+                session.run(
+                    """MATCH (n) WHERE any(label IN labels(n) WHERE label IN $labels)
+                    AND (n.graph = $name OR n.graph IS NULL)
+                    DETACH DELETE n""",
+                    labels=GRAPH_NODE_LABELS, name=name
+                ).consume()
+
+            failed = self.create_knowledge_graph(hotel_reviews)
+
+            with self.driver.session() as session:
+                session.run(
+                    """MATCH (n) WHERE any(label IN labels(n) WHERE label IN $labels) AND n.graph IS NULL
+                    SET n.graph = $name""",
+                    labels=GRAPH_NODE_LABELS, name=name
+                ).consume()
+                if failed:
+                    print(f"Graph '{name}' built with {failed} failed reviews/queries; "
+                          f"it is not marked current and will be rebuilt on the next start")
+                else:
+                    session.run(
+                        "MERGE (m:GraphMeta {name: $name}) SET m.version = $version, m.updated_at = datetime()",
+                        name=name, version=version
+                    ).consume()
+        finally:
+            self._release_build_lock(name, owner)
+
+        # Cached Cypher and entity names were built from the previous graph
+        with self._lock:
+            self._cypher_cache.clear()
+            self._entity_names = None
+
+        self.build_community_summaries()
+        self.build_vector_index(hotel_reviews)
+        return True
+
+    # Function to embed texts as unit vectors; index texts are cached, query texts are not
+    def _embed(self, texts, cache=True, batch_size=512):
+        with self._lock:
+            known = {text: self._embedding_cache[text] for text in texts if text in self._embedding_cache} if cache else {}
+        missing = [text for text in dict.fromkeys(texts) if text not in known]
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            response = self.openai_client.embeddings.create(model=EMBEDDING_MODEL, input=batch)
+            for text, item in zip(batch, response.data):
+                vector = np.asarray(item.embedding, dtype=np.float32)
+                known[text] = vector / (np.linalg.norm(vector) or 1.0)
+        if cache and missing:
+            with self._lock:
+                self._embedding_cache.update((text, known[text]) for text in missing)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([known[text] for text in texts])
+
+    # Function to build the local vector index over node names and raw review text
+    def build_vector_index(self, hotel_reviews=None):
+        """
+        Embed every node name in the graph (and the raw reviews, if given) into
+        in-memory matrices used for entity resolution and the vector-only fallback
+        """
+        with self.driver.session() as session:
+            nodes = [
+                (record["label"], record["name"])
+                for record in session.run(
+                    """MATCH (n) WHERE any(label IN labels(n) WHERE label IN $labels) AND n.name IS NOT NULL
+                    RETURN DISTINCT labels(n)[0] AS label, n.name AS name""",
+                    labels=GRAPH_NODE_LABELS
+                )
+            ]
+        node_matrix = self._embed([name for _, name in nodes])
+        reviews = [" ".join(review.split()) for review in hotel_reviews or []]
+        review_matrix = self._embed(reviews)
+
+        with self._lock:
+            self._node_index = (nodes, node_matrix)
+            if reviews:
+                self._review_index = (reviews, review_matrix)
+        print(f"Vector index built: {len(nodes)} nodes, {len(reviews)} reviews")
+
+    # Function to resolve entity mentions in a question to graph nodes by nearest neighbor
+    def resolve_entities(self, user_query, threshold=None):
+        """
+        Returns:
+            List of {"label", "name", "mention", "score"} for mentions whose nearest
+            node name is at least `threshold` cosine-similar
+        """
+        with self._lock:
+            node_index = self._node_index
+        mentions = _candidate_mentions(user_query)
+        if not node_index or not node_index[0] or not mentions:
+            return []
+
+        nodes, node_matrix = node_index
+        scores = self._embed(mentions, cache=False) @ node_matrix.T
+        best = scores.argmax(axis=1)
+        matches = {}
+        for row, column in enumerate(best):
+            score = float(scores[row, column])
+            if score < (threshold or ENTITY_MATCH_THRESHOLD):
+                continue
+            label, name = nodes[column]
+            if name not in matches or matches[name]["score"] < score:
+                matches[name] = {"label": label, "name": name, "mention": mentions[row], "score": score}
+        return sorted(matches.values(), key=lambda match: -match["score"])
+
+    # Function to answer from the most similar raw reviews when the graph has no match
+    def vector_context(self, user_query, top_k=None, token_budget=None):
+        with self._lock:
+            review_index = self._review_index
+        if not review_index:
+            return ""
+        reviews, review_matrix = review_index
+        scores = review_matrix @ self._embed([user_query], cache=False)[0]
+        token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+        lines = []
+        used_tokens = 0
+        for index in np.argsort(-scores)[:top_k or VECTOR_TOP_K]:
+            if used_tokens + _estimate_tokens(reviews[index]) > token_budget:
+                break
+            used_tokens += _estimate_tokens(reviews[index])
+            lines.append(f"- {reviews[index]}")
+        return "\n".join(lines)
+
+    # Function to summarize one community of hotels
+    def summarize_community(self, community_key, facts_text):
+        system_prompt = """You are an analyst summarizing part of a hotel knowledge graph.
+        Write a concise summary (at most 120 words) covering the hotels, their facilities,
+        customer types and reviewers. Mention every hotel by name. Do not invent facts."""
+
+        user_prompt = f"""Community: {community_key}
+
+        Facts (hotel,relationship,entity):
+        {facts_text}"""
+
+        response = self._chat([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ])
+        return response.choices[0].message.content
+
+    # Function to build or refresh the precomputed community summaries
+    def build_community_summaries(self, refresh_all=False):
+        """
+        Group hotels into communities by location and store an LLM summary per community
+        as (:Community {key, summary, fingerprint}) linked from its hotels. Hotels are re-linked
+        on every run (a rebuilt graph has new hotel nodes), but only communities whose facts
+        changed since the last run (new fingerprint) are re-summarized, and communities that
+        no longer exist are removed.
+
+        Args:
+            refresh_all: Re-summarize every community even if its facts are unchanged
+
+        Returns:
+            List of community keys that were (re)summarized
+        """
+        communities = {}
+        with self.driver.session() as session:
+            result = session.run("""
+                MATCH (h:Hotel)-[r]->(n)
+                WHERE NOT n:Community
+                OPTIONAL MATCH (h)-[:is_located_in]->(l:Location)
+                RETURN elementId(h) AS hotel_id, h.name AS hotel, type(r) AS relation,
+                       n.name AS entity, min(l.name) AS location
+            """)
+            for record in result:
+                community = communities.setdefault(record["location"] or "Unknown location", {
+                    "hotel_ids": set(),
+                    "facts": set()
+                })
+                community["hotel_ids"].add(record["hotel_id"])
+                community["facts"].add(f"{record['hotel']},{record['relation']},{record['entity']}")
+
+            existing = {
+                record["key"]: record["fingerprint"]
+                for record in session.run("MATCH (c:Community) RETURN c.key AS key, c.fingerprint AS fingerprint")
+            }
+
+        refreshed = []
+        for key, community in communities.items():
+            facts_text = "\n".join(sorted(community["facts"]))
+            fingerprint = hashlib.sha256(facts_text.encode("utf-8")).hexdigest()[:16]
+
+            with self.driver.session() as session:
+                # Only changed communities cost an LLM call
+                if refresh_all or existing.get(key) != fingerprint:
+                    summary = self.summarize_community(key, facts_text)
+                    session.run("""
+                        MERGE (c:Community {key: $key})
+                        SET c.summary = $summary, c.fingerprint = $fingerprint, c.updated_at = datetime()
+                    """, key=key, summary=summary, fingerprint=fingerprint)
+                    refreshed.append(key)
+
+                # Always re-link: after a rebuild the hotels are new nodes with the same facts
+                session.run("""
+                    MATCH (c:Community {key: $key})
+                    OPTIONAL MATCH (c)<-[old:in_community]-()
+                    DELETE old
+                    WITH DISTINCT c
+                    MATCH (h:Hotel) WHERE elementId(h) IN $hotel_ids
+                    MERGE (h)-[:in_community]->(c)
+                """, key=key, hotel_ids=list(community["hotel_ids"]))
+
+        stale = [key for key in existing if key not in communities]
+        if stale:
+            with self.driver.session() as session:
+                session.run("MATCH (c:Community) WHERE c.key IN $keys DETACH DELETE c", keys=stale)
+
+        print(f"Community summaries refreshed: {refreshed}")
+        return refreshed
+
+    # Function to collect the names of all graph entities, used to spot global questions
+    def _get_entity_names(self):
+        with self._lock:
+            if self._entity_names is not None:
+                return self._entity_names
+        with self.driver.session() as session:
+            names = {
+                " ".join(re.findall(r"\w+", name.lower()))
+                for name in session.run(
+                    "MATCH (n) WHERE any(label IN labels(n) WHERE label IN $labels) RETURN DISTINCT n.name AS name",
+                    labels=GRAPH_NODE_LABELS
+                ).value("name")
+                if name
+            }
+        with self._lock:
+            self._entity_names = names
+        return names
+
+    # Function to decide whether a question is about the graph as a whole
+    def is_global_question(self, user_query, entity_matches=None):
+        """
+        A question is global when it mentions no entity stored in the graph,
+        e.g. "What types of customers stay at these hotels?"
+
+        Mentions are resolved through the vector index, so "businessman" still finds
+        "Businessmen"; exact name matching is only the fallback when no index is built.
+
+        Args:
+            entity_matches: Result of resolve_entities for this question, if already computed
+        """
+        with self._lock:
+            has_index = bool(self._node_index and self._node_index[0])
+        if has_index:
+            if entity_matches is None:
+                entity_matches = self.resolve_entities(user_query)
+            return not entity_matches
+
+        text = " ".join(re.findall(r"\w+", user_query.lower()))
+        return not any(
+            re.search(rf"\b{re.escape(name)}", text)
+            for name in self._get_entity_names()
+        )
+
+    # Function to read the precomputed community summaries as answer context
+    def community_context(self, token_budget=None):
+        token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+        lines = []
+        used_tokens = 0
+        with self.driver.session() as session:
+            result = session.run("""
+                MATCH (c:Community)
+                OPTIONAL MATCH (h:Hotel)-[:in_community]->(c)
+                RETURN c.key AS key, c.summary AS summary, collect(h.name) AS hotels
+                ORDER BY size(hotels) DESC
+            """)
+            records = list(result)
+        for index, record in enumerate(records):
+            line = f"{record['key']} ({', '.join(record['hotels'])}): {record['summary']}"
+            if used_tokens + _estimate_tokens(line) > token_budget:
+                lines.append(f"... {len(records) - index} more communities omitted")
+                break
+            used_tokens += _estimate_tokens(line)
+            lines.append(line)
+        return "\n".join(lines)
+
+    # Function to retrieve the serialized graph context for a guarded query
+    def _retrieve_context(self, clean_query, token_budget=None):
+        return serialize_graph_results(
+            self.stream_neo4j_query(clean_query, CYPHER_TIMEOUT_SECONDS), token_budget
+        )
+
+    # Function to perform RAG query
+    def rag_query(self, user_query, token_budget=None):
+        """
+        Perform a RAG query using Neo4j and OpenAI
+
+        Args:
+            user_query: User's natural language query
+            token_budget: Maximum estimated tokens of graph context in the prompt
+
+        Returns:
+            Answer to the user's query
+        """
+        # Global questions (no resolvable entity) are answered from the precomputed community summaries
+        entity_hints = self.resolve_entities(user_query)
+        formatted_results = (
+            self.community_context(token_budget) if self.is_global_question(user_query, entity_hints) else ""
+        )
+
+        if not formatted_results:
+            # Generate a Cypher query that passes the cost guard
+            clean_query = self.generate_guarded_cypher(user_query, entity_hints=entity_hints)
+
+            # Execute the query and format the streamed results for the LLM
+            formatted_results = self._retrieve_context(clean_query, token_budget)
+
+            # Empty traversal: fall back to the reviews nearest to the question
+            if formatted_results == "No results found.":
+                formatted_results = self.vector_context(user_query, token_budget=token_budget) or formatted_results
+
+        # Generate answer using OpenAI
+        response = self._chat(_build_answer_messages(user_query, formatted_results), temperature=0.7)
+
+        return response.choices[0].message.content
+
+    # Function to perform RAG query with streamed output
+    def rag_query_stream(self, user_query, token_budget=None):
+        """
+        Streaming variant of rag_query
+
+        Args:
+            user_query: User's natural language query
+            token_budget: Maximum estimated tokens of graph context in the prompt
+
+        Yields:
+            (event, text) tuples: ("cypher", query), then ("status", message), then ("token", chunk)
+            for each piece of the answer as it is generated. Global questions answered from
+            community summaries skip the "cypher" event.
+        """
+        # Global questions (no resolvable entity) are answered from the precomputed community summaries
+        entity_hints = self.resolve_entities(user_query)
+        formatted_results = (
+            self.community_context(token_budget) if self.is_global_question(user_query, entity_hints) else ""
+        )
+
+        if formatted_results:
+            yield "status", "Answering from community summaries..."
+        else:
+            # Generate a Cypher query that passes the cost guard
+            clean_query = self.generate_guarded_cypher(user_query, entity_hints=entity_hints)
+            yield "cypher", clean_query
+
+            # Execute the query and format the streamed results for the LLM
+            formatted_results = self._retrieve_context(clean_query, token_budget)
+
+            # Empty traversal: fall back to the reviews nearest to the question
+            vector_results = ""
+            if formatted_results == "No results found.":
+                vector_results = self.vector_context(user_query, token_budget=token_budget)
+            if vector_results:
+                formatted_results = vector_results
+                yield "status", "No graph matches, answering from review text..."
+            else:
+                yield "status", "Retrieved graph context, generating answer..."
+
+        # Stream the answer tokens as they arrive
+        stream = self._chat(_build_answer_messages(user_query, formatted_results), temperature=0.7, stream=True)
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield "token", chunk.choices[0].delta.content
+
+    # Async entry point; the blocking clients run in the default thread pool
+    async def arag_query(self, user_query, token_budget=None):
+        return await asyncio.to_thread(self.rag_query, user_query, token_budget)
+
+# Engine shared by the module-level functions below
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+def get_default_engine():
+    """
+    Return the process-wide GraphRAGEngine, creating it on first use
+    """
+    global _default_engine
+    if _default_engine is None:
+        with _default_engine_lock:
+            if _default_engine is None:
+                _default_engine = GraphRAGEngine()
+    return _default_engine
+
+# Module-level functions kept for existing callers; they delegate to the default engine
+def identify_relationships_and_nodes(file_text):
+    return get_default_engine().identify_relationships_and_nodes(file_text)
+
+def identify_relationships_for_reviews(reviews, token_budget=None, max_reviews=None):
+    return get_default_engine().identify_relationships_for_reviews(reviews, token_budget, max_reviews)
+
+def generate_cypher_for_node_creation(ontology_text):
+    return get_default_engine().generate_cypher_for_node_creation(ontology_text)
+
+def query_neo4j_graph(user_query, feedback=None, entity_hints=None):
+    return get_default_engine().query_neo4j_graph(user_query, feedback, entity_hints)
+
+def execute_neo4j_query(cypher_query):
+    return get_default_engine().execute_neo4j_query(cypher_query)
+
+def stream_neo4j_query(cypher_query, timeout=None):
+    return get_default_engine().stream_neo4j_query(cypher_query, timeout)
+
+def guard_cypher_query(cypher_query):
+    return get_default_engine().guard_cypher_query(cypher_query)
+
+def generate_guarded_cypher(user_query, max_attempts=None):
+    return get_default_engine().generate_guarded_cypher(user_query, max_attempts)
+
+def create_knowledge_graph(hotel_reviews):
+    return get_default_engine().create_knowledge_graph(hotel_reviews)
+
+def ensure_knowledge_graph(hotel_reviews, name="hotel_reviews"):
+    return get_default_engine().ensure_knowledge_graph(hotel_reviews, name)
+
+def build_community_summaries(refresh_all=False):
+    return get_default_engine().build_community_summaries(refresh_all)
+
+def rag_query(user_query, token_budget=None):
+    return get_default_engine().rag_query(user_query, token_budget)
+
+def rag_query_stream(user_query, token_budget=None):
+    return get_default_engine().rag_query_stream(user_query, token_budget)
+
+# Function to measure throughput and latency of one engine under concurrent load
+def run_concurrency_benchmark(engine, queries, concurrency_levels=(1, 4, 16), use_asyncio=False):
+    """
+    Run every query at each concurrency level against the same engine
+
+    Args:
+        engine: GraphRAGEngine to exercise
+        queries: List of user questions; each level runs the whole list
+        concurrency_levels: Number of worker threads (or concurrent tasks) per run
+        use_asyncio: Drive the engine through arag_query and asyncio.gather instead of threads
+
+    Returns:
+        List of dicts with concurrency, queries, errors, qps, p50_s and p95_s
+    """
+    results = []
+    for concurrency in concurrency_levels:
+        latencies = []
+        errors = 0
+
+        def timed(query):
+            start = time.perf_counter()
+            engine.rag_query(query)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        if use_asyncio:
+            async def run_all():
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def one(query):
+                    async with semaphore:
+                        query_start = time.perf_counter()
+                        await engine.arag_query(query)
+                        return time.perf_counter() - query_start
+
+                return await asyncio.gather(*(one(q) for q in queries), return_exceptions=True)
+
+            outcomes = asyncio.run(run_all())
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = [executor.submit(timed, q) for q in queries]
+                outcomes = []
+                for future in futures:
+                    try:
+                        outcomes.append(future.result())
+                    except Exception as e:
+                        outcomes.append(e)
+        elapsed = time.perf_counter() - start
+
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                errors += 1
+            else:
+                latencies.append(outcome)
+
+        results.append({
+            "concurrency": concurrency,
+            "queries": len(queries),
+            "errors": errors,
+            "qps": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_s": float(np.percentile(latencies, 50)) if latencies else None,
+            "p95_s": float(np.percentile(latencies, 95)) if latencies else None
+        })
+        print(results[-1])
+    return results
 
 # Sample hotel reviews
 sample_hotel_reviews = [
@@ -321,6 +1329,193 @@ sample_hotel_reviews = [
     Reina Inoue recommended trying the local specialties during her stay."""
 ]
 
+# Colors used for each node type in the visualization
+NODE_COLORS = {
+    "Hotel": "red",
+    "Location": "blue",
+    "Facilities": "green",
+    "CustomerType": "purple",
+    "Reviewer": "orange"
+}
+
+# Maximum number of nodes drawn at once; larger graphs are paged by viewport or neighborhood
+MAX_RENDERED_NODES = 5000
+
+# Layouts computed once per graph and reused across callbacks, least recently used evicted first
+LAYOUT_CACHE_SIZE = int(os.getenv("LAYOUT_CACHE_SIZE", "8"))
+_layout_cache = OrderedDict()
+_layout_cache_lock = threading.Lock()
+
+# Function to build deduplicated node and edge arrays from relationship rows
+def build_graph_arrays(hotels, df):
+    """
+    Build node and edge tables with vectorized pandas operations
+
+    Args:
+        hotels: List of hotel names
+        df: DataFrame with hotel, relation, node_type and related_entity columns
+
+    Returns:
+        (nodes, edges) where nodes has id, label, node_type, color and degree columns
+        and edges has source, target (integer node positions) and relation columns
+    """
+    if df.empty:
+        df = pd.DataFrame(columns=["hotel", "relation", "node_type", "related_entity"])
+
+    hotel_nodes = pd.DataFrame({"label": pd.Series(hotels, dtype=object), "node_type": "Hotel"})
+    entity_nodes = df[["related_entity", "node_type"]].rename(columns={"related_entity": "label"})
+    nodes = (
+        pd.concat([hotel_nodes, entity_nodes], ignore_index=True)
+        .dropna(subset=["label"])
+        .drop_duplicates(subset=["node_type", "label"])
+        .reset_index(drop=True)
+    )
+    nodes["id"] = nodes["node_type"] + ":" + nodes["label"].astype(str)
+    nodes["color"] = nodes["node_type"].map(NODE_COLORS).fillna("gray")
+
+    index = pd.Series(np.arange(len(nodes)), index=nodes["id"])
+    source = index.reindex("Hotel:" + df["hotel"].astype(str)).to_numpy()
+    target = index.reindex(df["node_type"] + ":" + df["related_entity"].astype(str)).to_numpy()
+    edges = pd.DataFrame({"source": source, "target": target, "relation": df["relation"].to_numpy()})
+    edges = edges.dropna(subset=["source", "target"]).astype({"source": int, "target": int})
+
+    nodes["degree"] = np.bincount(
+        np.concatenate([edges["source"].to_numpy(), edges["target"].to_numpy()]),
+        minlength=len(nodes)
+    )
+    return nodes, edges
+
+# Function to compute (and cache) node positions for the graph
+def compute_graph_layout(nodes, edges):
+    """
+    Place hotels on a sunflower spiral and every other node at the centroid of its hotels.
+    Runs in O(nodes + edges) so it scales to graphs with 100k+ nodes.
+
+    Returns:
+        Array of shape (len(nodes), 2) with x, y positions
+    """
+    # Digest of the ordered node ids and edge list, so two graphs of the same size never share a layout
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(nodes["id"], index=False).to_numpy().tobytes())
+    digest.update(edges[["source", "target"]].to_numpy(dtype=np.int64).tobytes())
+    cache_key = digest.hexdigest()
+    with _layout_cache_lock:
+        if cache_key in _layout_cache:
+            _layout_cache.move_to_end(cache_key)
+            return _layout_cache[cache_key]
+
+    positions = np.zeros((len(nodes), 2))
+    is_hotel = (nodes["node_type"] == "Hotel").to_numpy()
+
+    # Hotels: golden-angle spiral gives an even spread without any iteration
+    hotel_idx = np.flatnonzero(is_hotel)
+    k = np.arange(len(hotel_idx))
+    radius = np.sqrt(k + 0.5)
+    angle = k * np.pi * (3 - np.sqrt(5))
+    positions[hotel_idx] = np.column_stack([radius * np.cos(angle), radius * np.sin(angle)])
+
+    # Other nodes: mean position of the hotels they are connected to
+    if len(edges):
+        sums = np.zeros((len(nodes), 2))
+        np.add.at(sums, edges["target"].to_numpy(), positions[edges["source"].to_numpy()])
+        counts = np.bincount(edges["target"].to_numpy(), minlength=len(nodes))
+        linked = (~is_hotel) & (counts > 0)
+        positions[linked] = sums[linked] / counts[linked, None]
+
+    # Deterministic jitter so nodes sharing a centroid do not overlap
+    rng = np.random.default_rng(0)
+    positions[~is_hotel] += rng.normal(scale=0.35, size=(int((~is_hotel).sum()), 2))
+
+    with _layout_cache_lock:
+        _layout_cache[cache_key] = positions
+        while len(_layout_cache) > LAYOUT_CACHE_SIZE:
+            _layout_cache.popitem(last=False)
+    return positions
+
+# Function to select which nodes to draw for a viewport or neighborhood
+def select_visible_nodes(nodes, edges, positions, x_range=None, y_range=None, focus=None):
+    """
+    Return a boolean mask of nodes to draw, capped at MAX_RENDERED_NODES
+
+    Args:
+        x_range, y_range: Current viewport bounds, or None for the full graph
+        focus: Node label whose 1-hop neighborhood should be shown
+    """
+    mask = np.ones(len(nodes), dtype=bool)
+
+    if focus:
+        center = np.flatnonzero((nodes["label"] == focus).to_numpy())
+        mask[:] = False
+        mask[center] = True
+        source = edges["source"].to_numpy()
+        target = edges["target"].to_numpy()
+        touching = np.isin(source, center) | np.isin(target, center)
+        mask[source[touching]] = True
+        mask[target[touching]] = True
+
+    if x_range is not None:
+        mask &= (positions[:, 0] >= x_range[0]) & (positions[:, 0] <= x_range[1])
+    if y_range is not None:
+        mask &= (positions[:, 1] >= y_range[0]) & (positions[:, 1] <= y_range[1])
+
+    # Too many nodes in view: keep the best connected ones
+    if mask.sum() > MAX_RENDERED_NODES:
+        candidates = np.flatnonzero(mask)
+        keep = candidates[np.argsort(-nodes["degree"].to_numpy()[candidates])[:MAX_RENDERED_NODES]]
+        mask[:] = False
+        mask[keep] = True
+    return mask
+
+# Function to build a WebGL figure for the visible part of the graph
+def build_graph_figure(nodes, edges, positions, mask):
+    """
+    Draw visible nodes and the edges between them with Scattergl traces
+    """
+    source = edges["source"].to_numpy()
+    target = edges["target"].to_numpy()
+    visible_edges = mask[source] & mask[target]
+    src_xy = positions[source[visible_edges]]
+    dst_xy = positions[target[visible_edges]]
+
+    # One line trace for all edges, separated by NaN gaps
+    gap = np.full(len(src_xy), np.nan)
+    edge_x = np.column_stack([src_xy[:, 0], dst_xy[:, 0], gap]).ravel()
+    edge_y = np.column_stack([src_xy[:, 1], dst_xy[:, 1], gap]).ravel()
+
+    visible = nodes[mask]
+    xy = positions[mask]
+
+    data = [
+        go.Scattergl(
+            x=edge_x,
+            y=edge_y,
+            mode="lines",
+            line={"width": 0.5, "color": "#999"},
+            hoverinfo="none"
+        ),
+        go.Scattergl(
+            x=xy[:, 0],
+            y=xy[:, 1],
+            mode="markers+text" if len(visible) <= 200 else "markers",
+            text=visible["label"],
+            textposition="top center",
+            hovertext=visible["node_type"] + ": " + visible["label"].astype(str),
+            hoverinfo="text",
+            marker={"size": 8 + 2 * np.log1p(visible["degree"].to_numpy()), "color": visible["color"]}
+        )
+    ]
+
+    layout = go.Layout(
+        title=f"Hotel Knowledge Graph ({len(visible)} of {len(nodes)} nodes)",
+        showlegend=False,
+        hovermode="closest",
+        uirevision="graph",
+        margin={"b": 40, "l": 40, "r": 40, "t": 40},
+        xaxis={"showgrid": False, "zeroline": False, "showticklabels": False},
+        yaxis={"showgrid": False, "zeroline": False, "showticklabels": False}
+    )
+    return go.Figure(data=data, layout=layout)
+
 # Create a Dash app for visualization
 def create_visualization_app(neo4j_uri, neo4j_username, neo4j_password):
     """
@@ -334,70 +1529,23 @@ def create_visualization_app(neo4j_uri, neo4j_username, neo4j_password):
     # Get all nodes and relationships
     with driver.session() as session:
         # Get hotels
-        hotels_result = session.run("MATCH (h:Hotel) RETURN h.name as name")
-        hotels = [record["name"] for record in hotels_result]
+        hotels = session.run("MATCH (h:Hotel) RETURN h.name as name").value("name")
         
         # Get all relationships
         relationships_result = session.run("""
             MATCH (h:Hotel)-[r]->(n)
+            WHERE NOT n:Community
             RETURN h.name as hotel, type(r) as relation, labels(n)[0] as node_type, n.name as related_entity
         """)
-        
-        relationships_data = [
-            {
-                "hotel": record["hotel"],
-                "relation": record["relation"],
-                "node_type": record["node_type"],
-                "related_entity": record["related_entity"]
-            }
-            for record in relationships_result
-        ]
-    
-    # Convert to DataFrame for easier manipulation
-    df = pd.DataFrame(relationships_data)
+        df = pd.DataFrame(
+            relationships_result.values("hotel", "relation", "node_type", "related_entity"),
+            columns=["hotel", "relation", "node_type", "related_entity"]
+        )
     
-    # Create network graph
-    def create_network_graph():
-        # Create nodes
-        nodes = []
-        node_colors = {
-            "Hotel": "red",
-            "Location": "blue",
-            "Facilities": "green",
-            "CustomerType": "purple",
-            "Reviewer": "orange"
-        }
-        
-        # Add hotel nodes
-        for hotel in hotels:
-            nodes.append({
-                "id": hotel,
-                "label": hotel,
-                "color": node_colors["Hotel"]
-            })
-        
-        # Add other nodes
-        for _, row in df.iterrows():
-            nodes.append({
-                "id": row["related_entity"],
-                "label": row["related_entity"],
-                "color": node_colors[row["node_type"]]
-            })
-        
-        # Create edges
-        edges = []
-        for _, row in df.iterrows():
-            edges.append({
-                "from": row["hotel"],
-                "to": row["related_entity"],
-                "label": row["relation"]
-            })
-        
-        # Return network data
-        return {
-            "nodes": nodes,
-            "edges": edges
-        }
+    # Build the graph and its layout once, server-side
+    nodes, edges = build_graph_arrays(hotels, df)
+    positions = compute_graph_layout(nodes, edges)
+    full_mask = select_visible_nodes(nodes, edges, positions)
     
     # Create app layout
     app.layout = html.Div([
@@ -405,26 +1553,16 @@ def create_visualization_app(neo4j_uri, neo4j_username, neo4j_password):
         
         html.Div([
             html.H3("Network Graph"),
+            dcc.Input(
+                id="focus-input",
+                type="text",
+                placeholder="Show neighborhood of a node (e.g. Creek Hotel)...",
+                debounce=True,
+                style={"width": "100%"}
+            ),
             dcc.Graph(
                 id="network-graph",
-                figure={
-                    "data": [
-                        go.Scatter(
-                            x=[1, 2, 3],
-                            y=[1, 2, 3],
-                            mode="markers",
-                            marker={"size": 12}
-                        )
-                    ],
-                    "layout": go.Layout(
-                        title="Hotel Knowledge Graph",
-                        showlegend=False,
-                        hovermode="closest",
-                        margin={"b": 40, "l": 40, "r": 40, "t": 40},
-                        xaxis={"showgrid": False, "zeroline": False, "showticklabels": False},
-                        yaxis={"showgrid": False, "zeroline": False, "showticklabels": False}
-                    )
-                }
+                figure=build_graph_figure(nodes, edges, positions, full_mask)
             )
         ]),
         
@@ -441,6 +1579,23 @@ def create_visualization_app(neo4j_uri, neo4j_username, neo4j_password):
         ])
     ])
     
+    # Redraw only the nodes in the current viewport or the focused neighborhood
+    @app.callback(
+        dash.Output("network-graph", "figure"),
+        dash.Input("network-graph", "relayoutData"),
+        dash.Input("focus-input", "value"),
+        prevent_initial_call=True
+    )
+    def update_graph(relayout_data, focus):
+        relayout_data = relayout_data or {}
+        x_range = y_range = None
+        if "xaxis.range[0]" in relayout_data:
+            x_range = (relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"])
+        if "yaxis.range[0]" in relayout_data:
+            y_range = (relayout_data["yaxis.range[0]"], relayout_data["yaxis.range[1]"])
+        mask = select_visible_nodes(nodes, edges, positions, x_range, y_range, focus)
+        return build_graph_figure(nodes, edges, positions, mask)
+    
     return app
 
 # Main function to run the complete pipeline
@@ -458,7 +1613,20 @@ def main():
     
     # Create knowledge graph
     print("\n1. Creating knowledge graph from hotel reviews...")
-    create_knowledge_graph(sample_hotel_reviews)
+    ensure_knowledge_graph(sample_hotel_reviews)
+    
+    # Optional concurrency benchmark: python graph_rag_withneo4j.py --benchmark
+    if "--benchmark" in sys.argv:
+        print("\nRunning concurrency benchmark...")
+        benchmark_queries = [
+            "which hotels are visited by businessmen?",
+            "What hotels are located in Dubai?",
+            "What facilities does Creek Hotel have?",
+            "Who reviewed the Buckingham Hotel?"
+        ] * 4
+        run_concurrency_benchmark(get_default_engine(), benchmark_queries)
+        run_concurrency_benchmark(get_default_engine(), benchmark_queries, use_asyncio=True)
+        return
     
     # Test RAG query
     print("\n2. Testing RAG query...")
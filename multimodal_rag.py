@@ -0,0 +1,1688 @@
+"""
+Multimodal RAG - ingestion and retrieval helpers used by MultimodalRagipynb.py
+"""
+
+import os
+import re
+import json
+import math
+import time
+import heapq
+import pickle
+import asyncio
+import base64
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader, PdfWriter
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import Runnable
+
+# Number of pages handed to one worker process
+PAGES_PER_CHUNK = int(os.getenv("PAGES_PER_CHUNK", "4"))
+
+# Function to split a PDF into page ranges
+def split_pdf_page_ranges(pdf_path, pages_per_chunk=PAGES_PER_CHUNK):
+    """
+    Return a list of (first_page, last_page) tuples, 1-based and inclusive
+    """
+    page_count = len(PdfReader(pdf_path).pages)
+    return [
+        (start, min(start + pages_per_chunk - 1, page_count))
+        for start in range(1, page_count + 1, pages_per_chunk)
+    ]
+
+# Worker: partition one page range of a PDF in its own process
+def _partition_page_range(pdf_path, first_page, last_page, work_dir, partition_kwargs):
+    # Imported here so the parent process does not pay for loading the layout models
+    from unstructured.partition.pdf import partition_pdf
+
+    chunk_dir = os.path.join(work_dir, f"pages-{first_page}-{last_page}")
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    # Write just this page range to its own PDF
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+    for page_index in range(first_page - 1, last_page):
+        writer.add_page(reader.pages[page_index])
+    chunk_pdf = os.path.join(chunk_dir, "chunk.pdf")
+    with open(chunk_pdf, "wb") as f:
+        writer.write(f)
+
+    elements = partition_pdf(
+        filename=chunk_pdf,
+        starting_page_number=first_page,
+        extract_image_block_output_dir=os.path.join(chunk_dir, "figures"),
+        **partition_kwargs
+    )
+
+    # Return plain (text, metadata) pairs so results pickle cheaply back to the parent
+    results = []
+    for element in elements:
+        metadata = element.metadata.to_dict()
+        metadata["category"] = element.category
+        metadata["source"] = pdf_path
+        # partition_pdf saw the temporary page-range file; point the file fields at the source PDF
+        metadata["filename"] = os.path.basename(pdf_path)
+        metadata["file_directory"] = os.path.dirname(pdf_path)
+        results.append((str(element), metadata))
+    return results
+
+# Function to partition a PDF page-parallel and merge the elements in page order
+def partition_pdf_parallel(pdf_path, image_output_dir, max_workers=None,
+                           pages_per_chunk=PAGES_PER_CHUNK, **partition_kwargs):
+    """
+    Partition a PDF with unstructured's hi_res strategy across a process pool
+
+    Args:
+        pdf_path: Path to the PDF
+        image_output_dir: Directory that receives the extracted figures as figure-<page>-<n>.jpg
+        max_workers: Worker processes, defaults to the CPU count
+        pages_per_chunk: Pages partitioned by each task
+        partition_kwargs: Extra arguments for partition_pdf
+
+    Returns:
+        List of Documents equivalent to UnstructuredPDFLoader(mode='elements'), in page order,
+        with metadata['category'], 'text_as_html' for tables and 'image_path' for figures
+    """
+    partition_kwargs = {
+        "strategy": "hi_res",
+        "extract_images_in_pdf": True,
+        "infer_table_structure": True,
+        **partition_kwargs
+    }
+    os.makedirs(image_output_dir, exist_ok=True)
+    page_ranges = split_pdf_page_ranges(pdf_path, pages_per_chunk)
+
+    work_dir = tempfile.mkdtemp(prefix="partition-")
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_partition_page_range, pdf_path, first, last, work_dir, partition_kwargs)
+                for first, last in page_ranges
+            ]
+            # Results are collected in submission order, i.e. page order
+            chunks = [future.result() for future in futures]
+
+        documents = []
+        figures_per_page = {}
+        for chunk in chunks:
+            for text, metadata in chunk:
+                # Move figures out of the per-worker directories, numbered per page like the loader does
+                image_path = metadata.get("image_path")
+                if image_path and os.path.exists(image_path):
+                    page = metadata.get("page_number", 0)
+                    figures_per_page[page] = figures_per_page.get(page, 0) + 1
+                    extension = os.path.splitext(image_path)[1] or ".jpg"
+                    target = os.path.join(image_output_dir, f"figure-{page}-{figures_per_page[page]}{extension}")
+                    shutil.move(image_path, target)
+                    metadata["image_path"] = target
+                documents.append(Document(page_content=text, metadata=metadata))
+        return documents
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# Function to measure partitioning throughput against the number of workers
+def benchmark_partitioning(pdf_paths, worker_counts=(1, 2, 4, 8), pages_per_chunk=PAGES_PER_CHUNK):
+    """
+    Partition every PDF once per worker count and report pages/sec
+
+    Args:
+        pdf_paths: Local sample corpus of PDFs
+        worker_counts: Process pool sizes to compare
+
+    Returns:
+        List of dicts with workers, pages, seconds and pages_per_sec
+    """
+    total_pages = sum(len(PdfReader(path).pages) for path in pdf_paths)
+    results = []
+    for workers in worker_counts:
+        image_dir = tempfile.mkdtemp(prefix="bench-figures-")
+        start = time.perf_counter()
+        try:
+            for path in pdf_paths:
+                partition_pdf_parallel(path, image_dir, max_workers=workers, pages_per_chunk=pages_per_chunk)
+        finally:
+            shutil.rmtree(image_dir, ignore_errors=True)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "workers": workers,
+            "pages": total_pages,
+            "seconds": round(elapsed, 2),
+            "pages_per_sec": round(total_pages / elapsed, 3) if elapsed else 0.0
+        })
+        print(results[-1])
+    return results
+
+# Default location of the persistent element summary cache
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "summary_cache.sqlite")
+
+class SummaryCache:
+    """
+    Persistent, content-addressed cache of element summaries.
+
+    Keys are sha256(content, prompt text, model), so re-ingesting an unchanged
+    element with the same prompt and model never calls the LLM again, while a
+    change to any of the three produces a new key.
+    """
+
+    def __init__(self, path=SUMMARY_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(content, prompt_text, model):
+        digest = hashlib.sha256()
+        for part in (content, prompt_text, model):
+            digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get_many(self, keys):
+        """
+        Return {key: summary} for the keys that are cached and update hit/miss counts
+        """
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, summary FROM summaries WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO summaries (key, summary) VALUES (?, ?)", items)
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+# Function to summarize elements through a chain, calling the LLM only for cache misses
+def summarize_with_cache(summarize_chain, elements, cache, prompt_text, model, max_concurrency=5):
+    """
+    Drop-in replacement for summarize_chain.batch(elements, {"max_concurrency": ...})
+
+    Args:
+        summarize_chain: Runnable that maps one element text to its summary
+        elements: List of element texts (text chunks or markdown tables)
+        cache: SummaryCache
+        prompt_text, model: Part of the cache key, so prompt or model changes re-summarize
+
+    Returns:
+        List of summaries aligned with elements
+    """
+    keys = [SummaryCache.make_key(element, prompt_text, model) for element in elements]
+    cached = cache.get_many(keys)
+
+    # Identical elements within the batch are summarized once
+    missing = {key: element for key, element in zip(keys, elements) if key not in cached}
+    if missing:
+        summaries = summarize_chain.batch(list(missing.values()), {"max_concurrency": max_concurrency})
+        new_items = list(zip(missing.keys(), summaries))
+        cache.put_many(new_items)
+        cached.update(new_items)
+
+    print(f"Summaries: {len(elements) - len(missing)} cached, {len(missing)} generated; {cache.stats()}")
+    return [cached[key] for key in keys]
+
+# Pixel budget for images sent to the vision model (width * height)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(1024 * 1024)))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# Worker: decode, downscale to the pixel budget and re-encode one image as JPEG
+def downscale_image(image_path, max_pixels=IMAGE_MAX_PIXELS, quality=IMAGE_JPEG_QUALITY):
+    """
+    A JPEG already within the pixel budget is returned as it is when re-encoding
+    would make it larger
+
+    Returns:
+        (jpeg_bytes, original_size_in_bytes)
+    """
+    from PIL import Image
+
+    original_bytes = os.path.getsize(image_path)
+    with Image.open(image_path) as img:
+        is_jpeg = img.format == "JPEG"
+        img = img.convert("RGB")
+        pixels = img.width * img.height
+        resized = pixels > max_pixels
+        if resized:
+            scale = (max_pixels / pixels) ** 0.5
+            img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    if is_jpeg and not resized and buffer.tell() >= original_bytes:
+        with open(image_path, "rb") as f:
+            return f.read(), original_bytes
+    return buffer.getvalue(), original_bytes
+
+# Function to build the vision message for one image
+def image_summary_message(img_base64, prompt):
+    return [
+        HumanMessage(content=[{"type": "text", "text": prompt},
+                              {"type": "image_url",
+                               "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"}}])
+    ]
+
+# Function to summarize JPEG images concurrently, calling the vision model only for cache misses
+def summarize_images(chat, jpegs, prompt, model, cache=None, max_concurrency=8, captions=None):
+    """
+    Args:
+        captions: Optional figure captions aligned with jpegs; a caption is added to that image's prompt
+
+    Returns:
+        (summaries aligned with jpegs, number of images sent to the model)
+    """
+    captions = captions or [None] * len(jpegs)
+    prompts = [f"{prompt}\nFigure caption: {caption}" if caption else prompt for caption in captions]
+    keys = [SummaryCache.make_key(jpeg, p, model) for jpeg, p in zip(jpegs, prompts)]
+    cached = cache.get_many(keys) if cache else {}
+    pending = [i for i, key in enumerate(keys) if key not in cached]
+    if pending:
+        responses = chat.batch(
+            [image_summary_message(base64.b64encode(jpegs[i]).decode("utf-8"), prompts[i]) for i in pending],
+            {"max_concurrency": max_concurrency}
+        )
+        new_items = [(keys[i], response.content) for i, response in zip(pending, responses)]
+        if cache:
+            cache.put_many(new_items)
+        cached.update(new_items)
+    return [cached[key] for key in keys], len(pending)
+
+# Function to summarize every image in a folder with downscaling and concurrent vision calls
+def generate_img_summaries_concurrent(path, prompt, chat, model, cache=None, max_concurrency=8,
+                                      max_pixels=IMAGE_MAX_PIXELS, workers=None, extensions=(".jpg",),
+                                      captions=None):
+    """
+    Downscale images in a process pool, then summarize them with one shared chat client
+
+    Args:
+        path: Folder with the images extracted from the PDF
+        prompt: Image summary prompt
+        chat: ChatOpenAI instance reused for every call; give it a rate_limiter
+            (e.g. InMemoryRateLimiter) to stay under the account's request rate
+        model: Model name, part of the summary cache key
+        cache: Optional SummaryCache
+        max_concurrency: Vision requests in flight at once
+        max_pixels: Pixel budget per image
+        captions: Optional {filename: figure caption}, e.g. from attach_figure_captions
+
+    Returns:
+        (img_base64_list, img_summaries, stats) in sorted filename order
+    """
+    start = time.perf_counter()
+    image_paths = [
+        os.path.join(path, name) for name in sorted(os.listdir(path))
+        if name.lower().endswith(tuple(extensions))
+    ]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        encoded = list(executor.map(downscale_image, image_paths, [max_pixels] * len(image_paths)))
+
+    img_base64_list = [base64.b64encode(jpeg).decode("utf-8") for jpeg, _ in encoded]
+    img_summaries, summarized = summarize_images(
+        chat, [jpeg for jpeg, _ in encoded], prompt, model, cache=cache, max_concurrency=max_concurrency,
+        captions=[(captions or {}).get(os.path.basename(image_path)) for image_path in image_paths]
+    )
+
+    elapsed = time.perf_counter() - start
+    original_bytes = sum(size for _, size in encoded)
+    sent_bytes = sum(len(jpeg) for jpeg, _ in encoded)
+    stats = {
+        "images": len(image_paths),
+        "summarized": summarized,
+        "images_per_sec": round(len(image_paths) / elapsed, 2) if elapsed else 0.0,
+        "original_bytes": original_bytes,
+        "sent_bytes": sent_bytes,
+        # Images that could only grow (non-JPEG sources under the budget) count as no saving
+        "bytes_saved": sum(max(0, size - len(jpeg)) for jpeg, size in encoded)
+    }
+    print(stats)
+    return img_base64_list, img_summaries, stats
+
+# Docstore record types
+RECORD_TEXT = "text"
+RECORD_TABLE = "table"
+RECORD_IMAGE = "image"
+
+# Function to encode a docstore record with an explicit type tag and MIME type
+def encode_record(record_type, payload, mime_type=None):
+    """
+    Records are b"<type>|<mime>\n" followed by the payload: UTF-8 text for text and
+    tables, raw bytes for images (no base64 in storage)
+    """
+    if mime_type is None:
+        mime_type = "text/markdown" if record_type == RECORD_TABLE else "text/plain"
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    return f"{record_type}|{mime_type}\n".encode("ascii") + payload
+
+# Function to decode a docstore record; only the short header is inspected
+def decode_record(raw):
+    """
+    Returns:
+        {"type", "mime_type", "data"} with data as str for text/table and bytes for images,
+        or None for a missing record
+    """
+    if raw is None:
+        return None
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    header, _, payload = raw.partition(b"\n")
+    record_type, _, mime_type = header.decode("ascii").partition("|")
+    data = payload if record_type == RECORD_IMAGE else payload.decode("utf-8")
+    return {"type": record_type, "mime_type": mime_type, "data": data}
+
+# Function to split decoded docstore records into images and texts for the prompt
+def split_records(raw_records):
+    """
+    O(1) per item: classification reads the type tag, images are never decoded or scanned
+
+    Returns:
+        {"images": [{"data": bytes, "mime_type": str}, ...], "texts": [str, ...]}
+    """
+    images = []
+    texts = []
+    for raw in raw_records:
+        record = decode_record(raw)
+        if record is None:
+            continue
+        if record["type"] == RECORD_IMAGE:
+            images.append({"data": record["data"], "mime_type": record["mime_type"]})
+        else:
+            texts.append(record["data"])
+    return {"images": images, "texts": texts}
+
+# Function to build the data URL for an image record; base64 is produced only here, at prompt time
+def image_data_url(image):
+    return f"data:{image['mime_type']};base64,{base64.b64encode(image['data']).decode('utf-8')}"
+
+# Overall prompt budget for retrieved context, and the most of it images may take
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+IMAGE_TOKEN_SHARE = float(os.getenv("IMAGE_TOKEN_SHARE", "0.5"))
+
+# Hamming distance between perceptual hashes below which two images count as duplicates
+IMAGE_DUPLICATE_DISTANCE = int(os.getenv("IMAGE_DUPLICATE_DISTANCE", "6"))
+
+# Candidate (detail, max side in pixels) levels, tried from most to least detailed
+IMAGE_DETAIL_LEVELS = (("high", 1024), ("high", 512), ("low", 512))
+
+# Function to estimate the token count of a text (about 4 characters per token)
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+# Function to estimate the vision tokens of an image at a given detail level
+def image_token_cost(width, height, detail="high"):
+    """
+    OpenAI vision pricing: low detail is a flat 85 tokens; high detail scales the image to
+    fit 2048x2048, then the short side to 768, and costs 85 + 170 per 512px tile
+    """
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = -(-int(width) // 512) * -(-int(height) // 512)
+    return 85 + 170 * tiles
+
+# Function to compute a 64-bit difference hash of an image
+def image_dhash(img):
+    """
+    Near-identical images (re-encoded, resized, repeated figures) differ in only a few bits
+    """
+    gray = img.convert("L").resize((9, 8))
+    pixels = list(gray.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+# Function to resize an image record to a max side, re-encoding it as JPEG only when it shrinks
+def _fit_image(img, data, max_side, quality=IMAGE_JPEG_QUALITY):
+    if max(img.width, img.height) <= max_side:
+        return data, img.width, img.height
+    from PIL import Image
+
+    scale = max_side / max(img.width, img.height)
+    resized = img.convert("RGB").resize(
+        (max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS
+    )
+    buffer = BytesIO()
+    resized.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue(), resized.width, resized.height
+
+# Function to fit retrieved records into one token budget across text, tables and images
+def budget_context(raw_records, token_budget=CONTEXT_TOKEN_BUDGET, image_share=IMAGE_TOKEN_SHARE,
+                   scores=None, duplicate_distance=IMAGE_DUPLICATE_DISTANCE):
+    """
+    Drop-in replacement for split_records that keeps the prompt within a token budget.
+
+    Records are taken in retrieval order (or by descending score when scores are given).
+    Texts and tables are added whole while they fit and the first one that does not is
+    truncated to the remaining budget. Images are deduplicated by perceptual hash and get
+    the most detailed level from IMAGE_DETAIL_LEVELS that fits both the remaining budget
+    and the image share; images that fit none are dropped.
+
+    Args:
+        raw_records: Docstore records as returned by MultiVectorRetriever
+        token_budget: Total context tokens
+        image_share: Fraction of token_budget images may use
+        scores: Optional retrieval scores aligned with raw_records
+
+    Returns:
+        {"images": [{"data", "mime_type", "detail"}], "texts": [str], "stats": {...}}
+    """
+    order = range(len(raw_records))
+    if scores is not None:
+        order = sorted(order, key=lambda i: scores[i], reverse=True)
+
+    remaining = token_budget
+    image_remaining = int(token_budget * image_share)
+    images, texts, hashes = [], [], []
+    stats = {"text_tokens": 0, "image_tokens": 0, "truncated": 0, "duplicate_images": 0, "dropped": 0}
+
+    for i in order:
+        record = decode_record(raw_records[i])
+        if record is None:
+            continue
+
+        if record["type"] != RECORD_IMAGE:
+            tokens = estimate_tokens(record["data"])
+            if tokens <= remaining:
+                texts.append(record["data"])
+            elif remaining > 50:
+                texts.append(record["data"][:remaining * 4] + " ...")
+                stats["truncated"] += 1
+                tokens = remaining
+            else:
+                stats["dropped"] += 1
+                continue
+            remaining -= tokens
+            stats["text_tokens"] += tokens
+            continue
+
+        from PIL import Image
+
+        with Image.open(BytesIO(record["data"])) as img:
+            img.load()
+            image_hash = image_dhash(img)
+            if any(bin(image_hash ^ seen).count("1") <= duplicate_distance for seen in hashes):
+                stats["duplicate_images"] += 1
+                continue
+            for detail, max_side in IMAGE_DETAIL_LEVELS:
+                scale = min(1.0, max_side / max(img.width, img.height))
+                cost = image_token_cost(img.width * scale, img.height * scale, detail)
+                if cost <= min(remaining, image_remaining):
+                    break
+            else:
+                stats["dropped"] += 1
+                continue
+            data, _, _ = _fit_image(img, record["data"], max_side)
+
+        hashes.append(image_hash)
+        mime_type = record["mime_type"] if data is record["data"] else "image/jpeg"
+        images.append({"data": data, "mime_type": mime_type, "detail": detail})
+        remaining -= cost
+        image_remaining -= cost
+        stats["image_tokens"] += cost
+
+    return {"images": images, "texts": texts, "stats": stats}
+
+class MultiVectorRetriever(Runnable):
+    """
+    Search the summary vectorstore but return the raw parent records from the docstore.
+
+    Summary hits are collapsed to unique parent doc_ids in rank order and all parents
+    are fetched with one batched mget (pipelined in chunks for large k). It is a
+    Runnable, so it can be piped straight into a LangChain chain.
+    """
+
+    def __init__(self, vectorstore, docstore, id_key="doc_id", k=5, fetch_k=None, mget_batch_size=100):
+        """
+        Args:
+            vectorstore: Store holding the summaries with the parent id in metadata[id_key]
+            docstore: Key-value store (e.g. RedisStore) holding the typed parent records
+            k: Number of unique parents to return
+            fetch_k: Summary hits to search before dedup, defaults to 2 * k
+            mget_batch_size: Keys per MGET; larger requests are split and pipelined
+        """
+        self.vectorstore = vectorstore
+        self.docstore = docstore
+        self.id_key = id_key
+        self.k = k
+        self.fetch_k = fetch_k or 2 * k
+        self.mget_batch_size = mget_batch_size
+
+    def _mget(self, doc_ids):
+        if len(doc_ids) <= self.mget_batch_size:
+            return self.docstore.mget(doc_ids)
+        batches = [doc_ids[i:i + self.mget_batch_size] for i in range(0, len(doc_ids), self.mget_batch_size)]
+        # RedisStore: send every MGET in one pipeline round-trip
+        client = getattr(self.docstore, "client", None)
+        if client is not None and hasattr(self.docstore, "_get_prefixed_key"):
+            pipe = client.pipeline(transaction=False)
+            for batch in batches:
+                pipe.mget([self.docstore._get_prefixed_key(doc_id) for doc_id in batch])
+            return [record for batch_records in pipe.execute() for record in batch_records]
+        return [record for batch in batches for record in self.docstore.mget(batch)]
+
+    def ranked_ids(self, query):
+        """
+        Unique parent doc_ids of the top-k summary hits, in rank order
+        """
+        hits = self.vectorstore.similarity_search(query, k=self.fetch_k)
+        return list(dict.fromkeys(
+            hit.metadata[self.id_key] for hit in hits if self.id_key in hit.metadata
+        ))[:self.k]
+
+    def invoke(self, query, config=None, **kwargs):
+        """
+        Returns:
+            Raw docstore records (text, tables, images) of the top-k unique parents, in rank order
+        """
+        doc_ids = self.ranked_ids(query)
+        if not doc_ids:
+            return []
+        return [record for record in self._mget(doc_ids) if record is not None]
+
+# Function to split text into lowercase search terms; keeps numbers and terms like "gpt-4o" or "3.5" whole
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*", text.lower())
+
+class BM25Index:
+    """
+    In-memory Okapi BM25 index over the element summaries (and raw text/tables).
+
+    Pure Python with an inverted index, so it works offline next to Chroma and
+    catches exact terms (names like "BERT", column headers, numbers) that cosine
+    similarity over summaries tends to miss.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.texts = {}
+        self._postings = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._avg_length = 0.0
+
+    def add(self, doc_id, text):
+        if doc_id in self.texts:
+            self.remove(doc_id)
+        terms = tokenize(text)
+        self.texts[doc_id] = text
+        self._lengths[doc_id] = len(terms)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            self._postings.setdefault(term, {})[doc_id] = count
+        # Running total keeps add/remove O(terms) instead of O(documents)
+        self._total_length += len(terms)
+        self._avg_length = self._total_length / len(self._lengths)
+
+    def remove(self, doc_id):
+        text = self.texts.pop(doc_id, None)
+        if text is None:
+            return
+        for term in set(tokenize(text)):
+            postings = self._postings.get(term, {})
+            postings.pop(doc_id, None)
+            if not postings:
+                self._postings.pop(term, None)
+        self._total_length -= self._lengths.pop(doc_id, 0)
+        self._avg_length = self._total_length / len(self._lengths) if self._lengths else 0.0
+
+    def search(self, query, k=10):
+        """
+        Returns:
+            [(doc_id, score), ...] best first
+        """
+        n = len(self.texts)
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / self._avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, docstore=None, id_key="doc_id", **kwargs):
+        """
+        Build the index from every summary in a Chroma collection; with a docstore the raw
+        text and table content of each parent is indexed along with its summary
+
+        Rebuild (or add/remove) after sync_source so it follows the vectorstore.
+        """
+        index = cls(**kwargs)
+        stored = vectorstore.get(include=["documents", "metadatas"])
+        texts = {}
+        for summary, metadata in zip(stored["documents"], stored["metadatas"]):
+            if metadata and id_key in metadata:
+                texts.setdefault(metadata[id_key], []).append(summary)
+        if docstore is not None and texts:
+            doc_ids = list(texts)
+            for doc_id, raw in zip(doc_ids, docstore.mget(doc_ids)):
+                record = decode_record(raw)
+                if record is not None and record["type"] != RECORD_IMAGE:
+                    texts[doc_id].append(record["data"])
+        for doc_id, parts in texts.items():
+            index.add(doc_id, "\n".join(parts))
+        return index
+
+# Function to fuse several rankings with weighted reciprocal rank fusion
+def reciprocal_rank_fusion(rankings, weights=None, rrf_k=60):
+    """
+    score(d) = sum_i weight_i / (rrf_k + rank_i(d)), ranks starting at 1
+
+    Args:
+        rankings: Lists of doc_ids, best first
+        weights: One weight per ranking, defaults to 1.0 each
+
+    Returns:
+        [(doc_id, score), ...] best first
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+class HybridRetriever(MultiVectorRetriever):
+    """
+    MultiVectorRetriever that fuses the vector ranking with a BM25 ranking by
+    reciprocal rank fusion before fetching the parents
+    """
+
+    def __init__(self, vectorstore, docstore, bm25_index, id_key="doc_id", k=5, fetch_k=None,
+                 vector_weight=1.0, bm25_weight=1.0, rrf_k=60, **kwargs):
+        """
+        Args:
+            bm25_index: BM25Index over the same doc_ids
+            vector_weight, bm25_weight: RRF weights; raise bm25_weight for exact-term heavy corpora
+            rrf_k: RRF damping constant
+        """
+        super().__init__(vectorstore, docstore, id_key=id_key, k=k, fetch_k=fetch_k, **kwargs)
+        self.bm25_index = bm25_index
+        self.vector_weight = vector_weight
+        self.bm25_weight = bm25_weight
+        self.rrf_k = rrf_k
+
+    def ranked_ids(self, query):
+        hits = self.vectorstore.similarity_search(query, k=self.fetch_k)
+        vector_ids = list(dict.fromkeys(
+            hit.metadata[self.id_key] for hit in hits if self.id_key in hit.metadata
+        ))
+        bm25_ids = [doc_id for doc_id, _ in self.bm25_index.search(query, k=self.fetch_k)]
+        fused = reciprocal_rank_fusion(
+            [vector_ids, bm25_ids], [self.vector_weight, self.bm25_weight], self.rrf_k
+        )
+        return [doc_id for doc_id, _ in fused[:self.k]]
+
+# Function to compare retrievers on a labelled query set
+def benchmark_retrievers(retrievers, labelled_queries):
+    """
+    Args:
+        retrievers: {name: retriever with ranked_ids(query)}
+        labelled_queries: [(query, set of relevant doc_ids), ...]
+
+    Returns:
+        {name: {"recall", "mrr", "mean_ms", "p95_ms"}}
+    """
+    results = {}
+    for name, retriever in retrievers.items():
+        recalls, reciprocal_ranks, latencies = [], [], []
+        for query, relevant in labelled_queries:
+            start = time.perf_counter()
+            ranked = retriever.ranked_ids(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found = [rank for rank, doc_id in enumerate(ranked, start=1) if doc_id in relevant]
+            recalls.append(len(found) / len(relevant) if relevant else 0.0)
+            reciprocal_ranks.append(1 / found[0] if found else 0.0)
+        latencies.sort()
+        results[name] = {
+            "recall": round(sum(recalls) / len(recalls), 3),
+            "mrr": round(sum(reciprocal_ranks) / len(reciprocal_ranks), 3),
+            "mean_ms": round(sum(latencies) / len(latencies), 1),
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 1)
+        }
+        print(name, results[name])
+    return results
+
+# Function to derive a stable id for an element from its source, type and content
+def element_id(source, record_type, content):
+    digest = hashlib.sha256()
+    for part in (source, record_type, content):
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+# Function to bring the vectorstore and docstore in line with the current elements of one source
+def sync_source(vectorstore, docstore, source, items, id_key="doc_id"):
+    """
+    Upsert the elements of one document and delete the ones that disappeared
+    (e.g. removed pages). Ids are content-derived and each summary carries a hash
+    of its text, so unchanged elements are neither re-embedded nor rewritten, while
+    an element whose summary changed (new prompt, model or caption) is replaced.
+
+    Args:
+        vectorstore: Persistent Chroma collection holding the summaries
+        docstore: Key-value store holding the typed records
+        source: Document identifier (e.g. the PDF path), stored in summary metadata
+        items: Iterable of (record_type, summary, content, mime_type) tuples; content is
+            text for text/table elements and raw bytes for images
+
+    Returns:
+        {"added", "updated", "unchanged", "deleted"} counts
+    """
+    entries, records = [], {}
+    for record_type, summary, content, mime_type in items:
+        doc_id = element_id(source, record_type, content)
+        entries.append((doc_id, record_type, summary))
+        records.setdefault(doc_id, encode_record(record_type, content, mime_type))
+    return sync_source_entries(vectorstore, docstore, source, entries,
+                               lambda doc_ids: {doc_id: records[doc_id] for doc_id in doc_ids}, id_key)
+
+# Function to sync one source from element ids and summaries, loading records only for what changed
+def sync_source_entries(vectorstore, docstore, source, entries, load_records, id_key="doc_id"):
+    """
+    sync_source without the element contents in memory: the docstore records are
+    fetched through load_records, and only for elements that are new or changed
+
+    Args:
+        entries: Iterable of (doc_id, record_type, summary) tuples
+        load_records: Function (list of doc_ids) -> {doc_id: encoded record}
+
+    Returns:
+        {"added", "updated", "unchanged", "deleted"} counts
+    """
+    stored = vectorstore.get(where={"source": source}, include=["metadatas"])
+    existing = {
+        doc_id: (metadata or {}).get("summary_hash")
+        for doc_id, metadata in zip(stored["ids"], stored["metadatas"])
+    }
+
+    new_docs, new_ids = [], []
+    current_ids = set()
+    updated = 0
+    for doc_id, record_type, summary in entries:
+        if doc_id in current_ids:
+            continue
+        current_ids.add(doc_id)
+        summary_hash = hashlib.sha256(summary.encode("utf-8")).hexdigest()[:16]
+        if doc_id in existing:
+            if existing[doc_id] == summary_hash:
+                continue
+            updated += 1
+        new_ids.append(doc_id)
+        new_docs.append(Document(page_content=summary, metadata={
+            id_key: doc_id, "type": record_type, "source": source, "summary_hash": summary_hash
+        }))
+
+    # Docstore first, so a summary never points at a missing parent;
+    # add_documents upserts, so a changed summary replaces the old one under the same id
+    if new_ids:
+        records = load_records(new_ids)
+        docstore.mset([(doc_id, records[doc_id]) for doc_id in new_ids])
+        vectorstore.add_documents(new_docs, ids=new_ids)
+
+    removed = [doc_id for doc_id in existing if doc_id not in current_ids]
+    if removed:
+        vectorstore.delete(ids=removed)
+        docstore.mdelete(removed)
+
+    stats = {
+        "added": len(new_ids) - updated,
+        "updated": updated,
+        "unchanged": len(current_ids) - len(new_ids),
+        "deleted": len(removed)
+    }
+    print(f"{source}: {stats}")
+    return stats
+
+# Default location of the structured table store
+TABLE_STORE_PATH = os.getenv("TABLE_STORE_PATH", "table_store.sqlite")
+
+# Rows of a local query result handed to the model
+TABLE_RESULT_MAX_ROWS = int(os.getenv("TABLE_RESULT_MAX_ROWS", "50"))
+
+# Function to turn a column header into a SQL-friendly identifier
+def _column_name(label, index, seen):
+    if isinstance(label, tuple):
+        label = " ".join(str(part) for part in label if not str(part).startswith("Unnamed"))
+    name = re.sub(r"[^0-9a-zA-Z]+", "_", str(label)).strip("_").lower() or f"col_{index}"
+    if name[0].isdigit():
+        name = f"c_{name}"
+    base, suffix = name, 2
+    while name in seen:
+        name, suffix = f"{base}_{suffix}", suffix + 1
+    seen.add(name)
+    return name
+
+# Function to parse an unstructured text_as_html table into a typed DataFrame
+def html_table_to_dataframe(html):
+    """
+    Headers become snake_case identifiers; columns whose values are numbers once
+    thousands separators, currency, percent signs and footnote markers are removed
+    are converted to numeric dtypes
+
+    Returns:
+        pandas DataFrame
+    """
+    import pandas as pd
+
+    df = pd.read_html(StringIO(html))[0]
+    seen = set()
+    df.columns = [_column_name(label, i, seen) for i, label in enumerate(df.columns)]
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        values = df[column].astype(str).str.strip()
+        cleaned = values.str.replace(r"[,$%*\s]", "", regex=True).str.replace(r"^\((.*)\)$", r"-\1", regex=True)
+        numeric = pd.to_numeric(cleaned, errors="coerce")
+        present = values.ne("") & df[column].notna()
+        # Convert only when (almost) every non-empty cell parses as a number
+        if present.any() and numeric[present].notna().mean() >= 0.9:
+            df[column] = numeric
+    return df
+
+class TableStore:
+    """
+    SQLite store of the tables extracted from PDFs, one typed SQL table per element.
+
+    Each table is keyed by the element id its summary is indexed under in the
+    vectorstore (element_id(source, RECORD_TABLE, markdown)), so a retrieved table
+    summary leads straight to a table that can be sorted, aggregated and filtered
+    locally instead of by the model.
+    """
+
+    def __init__(self, path=TABLE_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS table_catalog ("
+            "table_id TEXT PRIMARY KEY, sql_name TEXT NOT NULL, source TEXT, page_number INTEGER, "
+            "columns TEXT NOT NULL, row_count INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def sql_name(table_id):
+        return f"t_{table_id}"
+
+    @staticmethod
+    def quote(name):
+        """
+        Quote a name as an SQL identifier
+        """
+        return '"' + str(name).replace('"', '""') + '"'
+
+    def columns(self, table_id):
+        """
+        Column names of a stored table, from PRAGMA table_info
+        """
+        with self._lock:
+            rows = self._conn.execute(f"PRAGMA table_info({self.quote(self.sql_name(table_id))})").fetchall()
+        return [row[1] for row in rows]
+
+    def _checked_column(self, table_id, column):
+        # Only names that exist in the table reach the SQL, quoted as identifiers
+        if column not in self.columns(table_id):
+            raise ValueError(f"Unknown column {column!r} in table {self.sql_name(table_id)}")
+        return self.quote(column)
+
+    def add(self, table_id, html, source=None, page_number=None):
+        """
+        Parse and store one table; re-adding the same id replaces it
+
+        Returns:
+            The parsed DataFrame, or None if the HTML holds no parsable table
+        """
+        try:
+            df = html_table_to_dataframe(html)
+        except ValueError:
+            return None
+        sql_name = self.sql_name(table_id)
+        with self._lock:
+            df.to_sql(sql_name, self._conn, if_exists="replace", index=False)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO table_catalog VALUES (?, ?, ?, ?, ?, ?)",
+                (table_id, sql_name, source, page_number,
+                 json.dumps({column: str(dtype) for column, dtype in df.dtypes.items()}), len(df))
+            )
+            self._conn.commit()
+        return df
+
+    def add_element(self, source, markdown, html, page_number=None):
+        """
+        Store a table element under the same id sync_source gives its summary
+        """
+        table_id = element_id(source, RECORD_TABLE, markdown)
+        self.add(table_id, html, source=source, page_number=page_number)
+        return table_id
+
+    def prune(self, source, keep_ids):
+        """
+        Drop the tables of a source that are no longer among its elements
+        """
+        keep_ids = set(keep_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT table_id, sql_name FROM table_catalog WHERE source = ?", (source,)
+            ).fetchall()
+            removed = [(table_id, sql_name) for table_id, sql_name in rows if table_id not in keep_ids]
+            for table_id, sql_name in removed:
+                self._conn.execute(f'DROP TABLE IF EXISTS "{sql_name}"')
+                self._conn.execute("DELETE FROM table_catalog WHERE table_id = ?", (table_id,))
+            self._conn.commit()
+        return len(removed)
+
+    def describe(self, table_ids):
+        """
+        Schema text for the given tables: SQL name, columns with types, row count and two sample rows
+        """
+        lines = []
+        for table_id in table_ids:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT sql_name, columns, row_count FROM table_catalog WHERE table_id = ?", (table_id,)
+                ).fetchone()
+            if row is None:
+                continue
+            sql_name, columns, row_count = row
+            columns = ", ".join(f"{name} {dtype}" for name, dtype in json.loads(columns).items())
+            sample = self.query(f'SELECT * FROM "{sql_name}" LIMIT 2')
+            lines.append(f"Table {sql_name} ({row_count} rows): {columns}\nSample rows:\n{sample.to_string(index=False)}")
+        return "\n\n".join(lines)
+
+    def query(self, sql, max_rows=TABLE_RESULT_MAX_ROWS):
+        """
+        Run a read-only SELECT and return at most max_rows rows as a DataFrame
+
+        Raises:
+            ValueError: For anything other than a single SELECT statement
+        """
+        import pandas as pd
+
+        statement = sql.strip().rstrip(";")
+        if not re.match(r"(?is)^\s*(select|with)\b", statement) or ";" in statement:
+            raise ValueError(f"Only single SELECT statements are allowed: {sql}")
+        with self._lock:
+            self._conn.execute("PRAGMA query_only = ON")
+            try:
+                return pd.read_sql_query(f"SELECT * FROM ({statement}) LIMIT {int(max_rows)}", self._conn)
+            finally:
+                self._conn.execute("PRAGMA query_only = OFF")
+
+    def top_k(self, table_id, column, k=5, ascending=False):
+        """
+        Rows with the k largest (or smallest) values of a column
+        """
+        order = "ASC" if ascending else "DESC"
+        column = self._checked_column(table_id, column)
+        return self.query(f"SELECT * FROM {self.quote(self.sql_name(table_id))} ORDER BY {column} {order} LIMIT {int(k)}")
+
+    def aggregate(self, table_id, column, func="SUM", group_by=None):
+        """
+        SUM/AVG/MIN/MAX/COUNT of a column, optionally grouped
+        """
+        func = func.upper()
+        if func not in ("SUM", "AVG", "MIN", "MAX", "COUNT"):
+            raise ValueError(f"Unsupported aggregate: {func}")
+        sql_name = self.quote(self.sql_name(table_id))
+        alias = self.quote(f"{func.lower()}_{column}")
+        column = self._checked_column(table_id, column)
+        if group_by:
+            group_by = self._checked_column(table_id, group_by)
+            return self.query(
+                f"SELECT {group_by}, {func}({column}) AS {alias} "
+                f"FROM {sql_name} GROUP BY {group_by} ORDER BY 2 DESC"
+            )
+        return self.query(f"SELECT {func}({column}) AS {alias} FROM {sql_name}")
+
+# Prompt used to turn a question into SQL over the retrieved tables
+TABLE_SQL_PROMPT = """
+You write one SQLite SELECT statement that answers the question using only the tables below.
+Use the exact table and column names. Use ORDER BY and LIMIT for "top"/"largest"/"smallest" questions
+and aggregate functions for totals and averages. Return only the SQL, no explanation.
+
+Tables:
+{schema}
+
+Question: {question}
+"""
+
+# Function to answer a numeric question over stored tables with a local SQL query
+def query_tables(chat, question, table_store, table_ids, max_rows=TABLE_RESULT_MAX_ROWS):
+    """
+    The model sees only the table schemas and writes SQL; sorting and aggregation run
+    locally, and only the small result goes back into the answer prompt
+
+    Args:
+        chat: Chat model used to write the SQL
+        question: User question
+        table_store: TableStore
+        table_ids: Ids of the retrieved table summaries (metadata["doc_id"])
+
+    Returns:
+        {"sql", "result" (DataFrame), "text" (CSV for the answer prompt)}, or None when no table could answer it
+    """
+    schema = table_store.describe(table_ids)
+    if not schema:
+        return None
+    response = chat.invoke(TABLE_SQL_PROMPT.format(schema=schema, question=question))
+    sql = re.sub(r"^```(?:sql)?\s*|\s*```$", "", response.content.strip())
+    try:
+        result = table_store.query(sql, max_rows=max_rows)
+    except Exception as e:
+        print(f"Table query failed: {e}")
+        return None
+    return {"sql": sql, "result": result, "text": result.to_csv(index=False)}
+
+# Element categories indexed as text; tables and images are handled separately
+TEXT_CATEGORIES = ("NarrativeText", "Title", "UncategorizedText", "Header", "FigureCaption")
+
+# Default summary prompts, the same ones the notebook uses
+TEXT_SUMMARY_PROMPT = """
+You are an assistant tasked with summarizing tables and text particularly for semantic retrieval.
+These summaries will be embedded and used to retrieve the raw text or table elements.
+Give a detailed summary of the table or text below that is well optimized for retrieval.
+For any tabels also add in a one line description of what the table is about besides the summary.
+Do not add redundant words like summary.
+just output the actual summary content.
+
+Table or Text chunk:
+{element}
+
+"""
+
+IMAGE_SUMMARY_PROMPT = """
+  You are an assistant tasked with summarizing images for retrieval.
+  Remember these images could potentially contain graph, charts or tables also.
+  These summaries will be embedded and used to retrieve the raw image for question answering.
+  Give a detailed summary of the image that is well optimized for retrieval.
+  Do not add additional words like summary: etc.
+  """
+
+# Token size of a merged section chunk
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "1000"))
+
+# Function to attach each figure caption to the nearest image on its page
+def attach_figure_captions(elements):
+    """
+    Sets metadata["caption"] on Image elements, looking at the closest FigureCaption
+    on the same page (by position in the element list)
+
+    Args:
+        elements: Documents in page order, as returned by partition_pdf_parallel
+
+    Returns:
+        Set of indices of the FigureCaption elements that were attached
+    """
+    images = [i for i, element in enumerate(elements) if element.metadata.get("category") == "Image"]
+    attached = set()
+    for i, element in enumerate(elements):
+        if element.metadata.get("category") != "FigureCaption":
+            continue
+        page = element.metadata.get("page_number")
+        candidates = [
+            j for j in images
+            if elements[j].metadata.get("page_number") == page and "caption" not in elements[j].metadata
+        ]
+        if candidates:
+            nearest = min(candidates, key=lambda j: abs(j - i))
+            elements[nearest].metadata["caption"] = element.page_content
+            attached.add(i)
+    return attached
+
+# Function to merge text elements into section-level chunks under their titles
+def merge_section_chunks(elements, max_tokens=CHUNK_MAX_TOKENS, text_categories=TEXT_CATEGORIES):
+    """
+    Group consecutive text elements under the most recent Title into chunks of at most
+    max_tokens, so each section is summarized and embedded once instead of element by element.
+    Consecutive titles are merged into one heading, a section longer than max_tokens continues
+    in a new chunk that repeats the heading, and captions attached to images are left out.
+    A heading always stays with the first element of its body, even when that element alone
+    exceeds max_tokens; trailing titles with no body are appended to the previous chunk.
+
+    Args:
+        elements: Documents in page order with metadata["category"]
+
+    Returns:
+        Documents with metadata: category "Section", section (heading), source, page_numbers,
+        element_indices and categories of the merged elements (provenance)
+    """
+    attached = attach_figure_captions(elements)
+    chunks = []
+    section = None
+    parts, indices = [], []
+    tokens = 0
+    has_body = False
+
+    def flush():
+        if not parts:
+            return
+        pages = {elements[i].metadata.get("page_number") for i in indices} - {None}
+        if not has_body and chunks:
+            # A heading with nothing under it would be a chunk of its own; keep it with the text before it
+            metadata = chunks[-1].metadata
+            chunks[-1].page_content += "\n\n" + "\n\n".join(parts)
+            metadata["page_numbers"] = sorted(set(metadata["page_numbers"]) | pages)
+            metadata["element_indices"].extend(indices)
+            metadata["categories"].extend(elements[i].metadata.get("category") for i in indices)
+        else:
+            chunks.append(Document(page_content="\n\n".join(parts), metadata={
+                "category": "Section",
+                "section": section,
+                "source": elements[indices[0]].metadata.get("source"),
+                "page_numbers": sorted(pages),
+                "element_indices": list(indices),
+                "categories": [elements[i].metadata.get("category") for i in indices]
+            }))
+        parts.clear()
+        indices.clear()
+
+    for i, element in enumerate(elements):
+        category = element.metadata.get("category")
+        if category not in text_categories or i in attached or not element.page_content.strip():
+            continue
+        text = element.page_content
+        element_tokens = estimate_tokens(text)
+        if category == "Title":
+            if has_body:
+                flush()
+                section, tokens, has_body = None, 0, False
+            # Consecutive titles (heading + subheading) form one heading
+            section = f"{section} / {text}" if section else text
+        else:
+            # Only split once the section has body text, so the heading is never left alone
+            if has_body and tokens + element_tokens > max_tokens:
+                flush()
+                tokens = 0
+                # Continuation chunks repeat the heading so they stay retrievable by it
+                if section:
+                    parts.append(section)
+                    tokens = estimate_tokens(section)
+            has_body = True
+        parts.append(text)
+        indices.append(i)
+        tokens += element_tokens
+    flush()
+    return chunks
+
+# Bounded queue size between pipeline stages, in page-range batches
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+
+# Function to yield every PDF under a path lazily, in sorted order
+def iter_pdf_paths(path):
+    if os.path.isfile(path):
+        yield path
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                yield os.path.join(root, name)
+
+# Function to turn partitioned text and table elements into (record_type, content, mime_type) items
+def prepare_elements(elements, max_tokens=CHUNK_MAX_TOKENS):
+    """
+    Tables are converted from text_as_html to markdown like the notebook does, text elements
+    are merged into section chunks and figure captions are attached to their images
+
+    Args:
+        elements: (text, metadata) pairs as returned by _partition_page_range
+        max_tokens: Section chunk size
+
+    Returns:
+        (items as (record_type, content, mime_type), figures as (image_path, caption),
+        tables as (markdown, html, page_number) for TableStore.add_element)
+    """
+    import htmltabletomd
+
+    documents = [Document(page_content=text, metadata=metadata) for text, metadata in elements]
+    items, tables = [], []
+    for document in documents:
+        metadata = document.metadata
+        if metadata.get("category") == "Table":
+            html = metadata.get("text_as_html")
+            markdown = htmltabletomd.convert_table(html) if html else document.page_content
+            if html:
+                tables.append((markdown, html, metadata.get("page_number")))
+            items.append((RECORD_TABLE, markdown, None))
+    items.extend((RECORD_TEXT, chunk.page_content, None) for chunk in merge_section_chunks(documents, max_tokens))
+    figures = [
+        (document.metadata["image_path"], document.metadata.get("caption"))
+        for document in documents
+        if document.metadata.get("image_path") and os.path.exists(document.metadata["image_path"])
+    ]
+    return items, figures, tables
+
+class IngestionPipeline:
+    """
+    Streaming ingestion: partition -> prepare -> summarize -> store.
+
+    Stages run as asyncio tasks connected by bounded queues of page-range batches,
+    so summarizing early pages overlaps partitioning later ones and at most
+    queue_size batches wait between two stages. Blocking work (PDF parsing, LLM
+    calls, store writes) runs in worker threads or processes, never on the event loop.
+    The summarize stage spools each batch's contents to a file, so the store stage
+    holds only a document's ids and summaries until the document ends and reads back
+    just the records that sync_source_entries needs; memory stays flat over any
+    number of PDFs.
+
+    A document that fails in any stage is logged and skipped: its remaining batches
+    are dropped and its stored elements and tables are left as they were, so a partial document
+    never replaces a complete one. The other documents are ingested as usual.
+    """
+
+    STAGES = ("partition", "prepare", "summarize", "store")
+
+    def __init__(self, vectorstore, docstore, summarize_chain, vision_chat, cache, model,
+                 text_prompt=TEXT_SUMMARY_PROMPT, image_prompt=IMAGE_SUMMARY_PROMPT,
+                 queue_size=PIPELINE_QUEUE_SIZE, workers=None, max_concurrency=5,
+                 pages_per_chunk=PAGES_PER_CHUNK, report_interval=10.0, table_store=None,
+                 chunk_max_tokens=CHUNK_MAX_TOKENS, **partition_kwargs):
+        """
+        Args:
+            vectorstore, docstore: Targets passed to sync_source
+            summarize_chain: Runnable mapping one element text to its summary
+            vision_chat: Chat model used for image summaries
+            cache: SummaryCache shared by text and image summaries
+            model: Model name, part of the summary cache key
+            queue_size: Max batches waiting between two stages
+            workers: Process pool size for partitioning and downscaling
+            max_concurrency: LLM requests in flight per batch
+            report_interval: Seconds between progress reports, 0 disables them
+            table_store: Optional TableStore kept in sync with the tables of each document,
+                written by the store stage once the document is complete
+            chunk_max_tokens: Size of the merged section chunks
+        """
+        self.vectorstore = vectorstore
+        self.docstore = docstore
+        self.summarize_chain = summarize_chain
+        self.vision_chat = vision_chat
+        self.cache = cache
+        self.model = model
+        self.text_prompt = text_prompt
+        self.image_prompt = image_prompt
+        self.queue_size = queue_size
+        self.workers = workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency
+        self.pages_per_chunk = pages_per_chunk
+        self.report_interval = report_interval
+        self.table_store = table_store
+        self.chunk_max_tokens = chunk_max_tokens
+        self.partition_kwargs = {
+            "strategy": "hi_res",
+            "extract_images_in_pdf": True,
+            "infer_table_structure": True,
+            **partition_kwargs
+        }
+        self.stats = {}
+        self._queues = {}
+        self._failed = set()
+
+    def _reset_stats(self):
+        self.stats = {
+            stage: {"batches": 0, "elements": 0, "busy_seconds": 0.0, "max_queue_depth": 0}
+            for stage in self.STAGES
+        }
+        self.stats["store"].update({"documents": 0, "added": 0, "updated": 0, "unchanged": 0, "deleted": 0,
+                                    "failed": 0})
+        self._failed = set()
+
+    async def _get(self, stage):
+        # Record how full the stage's input queue is every time it takes work
+        queue = self._queues[stage]
+        stats = self.stats[stage]
+        stats["max_queue_depth"] = max(stats["max_queue_depth"], queue.qsize())
+        return await queue.get()
+
+    def _record(self, stage, started, elements):
+        stats = self.stats[stage]
+        stats["batches"] += 1
+        stats["elements"] += elements
+        stats["busy_seconds"] += time.perf_counter() - started
+
+    def _fail(self, stage, source, error):
+        # Mark the document failed once; later stages drop its batches and skip its sync
+        print(f"{stage}: skipping {source}: {type(error).__name__}: {error}")
+        if source not in self._failed:
+            self._failed.add(source)
+            self.stats["store"]["failed"] += 1
+
+    async def _partition_stage(self, pdf_paths, pool, work_dir):
+        loop = asyncio.get_running_loop()
+        out = self._queues["prepare"]
+        in_flight = deque()
+
+        async def emit_oldest():
+            source, source_dir, future, started = in_flight.popleft()
+            if future is None:
+                # The end marker is always forwarded so later stages release the document
+                await out.put((source, source_dir, None))
+                return
+            try:
+                elements = await future
+            except Exception as error:
+                self._fail("partition", source, error)
+                return
+            if source in self._failed:
+                return
+            self._record("partition", started, len(elements))
+            await out.put((source, source_dir, elements))
+
+        # Keep one page range per worker in flight across document boundaries
+        for pdf_path in pdf_paths:
+            try:
+                # Reading the page count parses the PDF, so it runs off the event loop
+                page_ranges = await asyncio.to_thread(split_pdf_page_ranges, pdf_path, self.pages_per_chunk)
+            except Exception as error:
+                self._fail("partition", pdf_path, error)
+                continue
+            source_dir = tempfile.mkdtemp(prefix="doc-", dir=work_dir)
+            for first, last in page_ranges:
+                while sum(1 for entry in in_flight if entry[2] is not None) >= self.workers:
+                    await emit_oldest()
+                future = loop.run_in_executor(pool, _partition_page_range, pdf_path, first, last,
+                                              source_dir, self.partition_kwargs)
+                in_flight.append((pdf_path, source_dir, future, time.perf_counter()))
+            # End-of-document marker, kept in page order behind the document's batches
+            in_flight.append((pdf_path, source_dir, None, None))
+        while in_flight:
+            await emit_oldest()
+        await out.put(None)
+
+    async def _prepare_stage(self, pool):
+        loop = asyncio.get_running_loop()
+        out = self._queues["summarize"]
+        # Each document's latest batch is held until the next one arrives, so titles that end
+        # a batch can move to the batch with their body and the last batch keeps its trailing titles
+        held = {}
+
+        async def prepare(source, elements):
+            started = time.perf_counter()
+            try:
+                items, figures, tables = await asyncio.to_thread(prepare_elements, elements, self.chunk_max_tokens)
+                # Downscale the batch's figures in the process pool
+                downscaled = await asyncio.gather(
+                    *(loop.run_in_executor(pool, downscale_image, path) for path, _ in figures)
+                )
+            except Exception as error:
+                self._fail("prepare", source, error)
+                return
+            for jpeg, _ in downscaled:
+                items.append((RECORD_IMAGE, jpeg, "image/jpeg"))
+            self._record("prepare", started, len(items))
+            await out.put((source, items, [caption for _, caption in figures], tables))
+
+        while (batch := await self._get("prepare")) is not None:
+            source, source_dir, elements = batch
+            if elements is None:
+                last = held.pop(source, None)
+                if last and source not in self._failed:
+                    await prepare(source, last)
+                # Every batch of this document has been read, its figures are no longer needed
+                await asyncio.to_thread(shutil.rmtree, source_dir, ignore_errors=True)
+                await out.put((source, None, None, None))
+                continue
+            if source in self._failed:
+                continue
+            # Sections are merged within a page-range batch; a heading that ends the previous
+            # batch is carried into this one so it is chunked with the body that follows it
+            previous = held.pop(source, [])
+            cut = len(previous)
+            while cut and previous[cut - 1][1].get("category") == "Title":
+                cut -= 1
+            held[source] = previous[cut:] + elements
+            if cut:
+                await prepare(source, previous[:cut])
+        await out.put(None)
+
+    @staticmethod
+    def _spool_batch(work_dir, source, items, summaries, tables):
+        # The batch's records and tables go to a file; only ids and summaries move on to the store stage
+        entries, records = [], {}
+        for (record_type, content, mime_type), summary in zip(items, summaries):
+            doc_id = element_id(source, record_type, content)
+            entries.append((doc_id, record_type, summary))
+            records.setdefault(doc_id, encode_record(record_type, content, mime_type))
+        fd, path = tempfile.mkstemp(prefix="batch-", suffix=".pkl", dir=work_dir)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"records": records, "tables": tables}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return entries, path
+
+    async def _summarize_stage(self, work_dir):
+        out = self._queues["store"]
+        while (batch := await self._get("summarize")) is not None:
+            source, items, captions, tables = batch
+            if items is None:
+                await out.put((source, None, None))
+                continue
+            if source in self._failed:
+                continue
+            started = time.perf_counter()
+            texts = [item for item in items if item[0] != RECORD_IMAGE]
+            images = [item for item in items if item[0] == RECORD_IMAGE]
+            try:
+                text_summaries, (image_summaries, _) = await asyncio.gather(
+                    asyncio.to_thread(summarize_with_cache, self.summarize_chain, [c for _, c, _ in texts],
+                                      self.cache, self.text_prompt, self.model, self.max_concurrency),
+                    asyncio.to_thread(summarize_images, self.vision_chat, [c for _, c, _ in images],
+                                      self.image_prompt, self.model, self.cache, self.max_concurrency, captions)
+                )
+                entries, spool_path = await asyncio.to_thread(
+                    self._spool_batch, work_dir, source, texts + images,
+                    list(text_summaries) + list(image_summaries), tables
+                )
+            except Exception as error:
+                self._fail("summarize", source, error)
+                continue
+            self._record("summarize", started, len(entries))
+            await out.put((source, entries, spool_path))
+        await out.put(None)
+
+    def _sync_document(self, source, entries, spool_paths):
+        # Runs in a worker thread: reads the spooled records of new or changed elements only
+        def load_spools():
+            for path in spool_paths:
+                with open(path, "rb") as f:
+                    yield pickle.load(f)
+
+        def load_records(doc_ids):
+            wanted = set(doc_ids)
+            records = {}
+            for spool in load_spools():
+                records.update((doc_id, record) for doc_id, record in spool["records"].items() if doc_id in wanted)
+            return records
+
+        result = sync_source_entries(self.vectorstore, self.docstore, source, entries, load_records)
+        if self.table_store is not None:
+            # Replace the document's typed SQL tables with the ones it has now
+            table_ids = [self.table_store.add_element(source, markdown, html, page_number)
+                         for spool in load_spools() for markdown, html, page_number in spool["tables"]]
+            self.table_store.prune(source, table_ids)
+        return result
+
+    @staticmethod
+    def _remove_spools(spool_paths):
+        for path in spool_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def _store_stage(self):
+        # Per document: (entries as (doc_id, record_type, summary), spool file paths)
+        pending = {}
+        stats = self.stats["store"]
+        while (batch := await self._get("store")) is not None:
+            source, entries, spool_path = batch
+            if entries is not None:
+                document = pending.setdefault(source, ([], []))
+                document[0].extend(entries)
+                document[1].append(spool_path)
+                continue
+            entries, spool_paths = pending.pop(source, ([], []))
+            try:
+                if source in self._failed:
+                    # Syncing a partial document would delete the elements it is missing
+                    continue
+                # Document complete: embed new summaries, delete elements that disappeared,
+                # then bring its SQL tables in line, so a skipped document never writes tables
+                started = time.perf_counter()
+                try:
+                    result = await asyncio.to_thread(self._sync_document, source, entries, spool_paths)
+                except Exception as error:
+                    self._fail("store", source, error)
+                    continue
+                self._record("store", started, len(entries))
+                stats["documents"] += 1
+                for key in ("added", "updated", "unchanged", "deleted"):
+                    stats[key] += result[key]
+            finally:
+                await asyncio.to_thread(self._remove_spools, spool_paths)
+
+    def report(self, elapsed):
+        """
+        Print one line per stage with throughput and queue depth
+        """
+        for stage in self.STAGES:
+            stats = self.stats[stage]
+            queue = self._queues.get(stage)
+            busy = stats["busy_seconds"]
+            print(
+                f"{stage:<10} {stats['elements']:>7} elements  "
+                f"{stats['elements'] / busy if busy else 0.0:>8.1f}/s busy  "
+                f"{stats['elements'] / elapsed if elapsed else 0.0:>8.1f}/s wall"
+                + (f"  queue {queue.qsize()}/{self.queue_size} (max {stats['max_queue_depth']})" if queue else "")
+            )
+
+    async def _reporter(self, started):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.report(time.perf_counter() - started)
+
+    async def arun(self, pdf_paths):
+        """
+        Ingest an iterable of PDF paths; the iterable is consumed lazily
+
+        Returns:
+            Per-stage stats, the failed documents and total elapsed seconds
+        """
+        self._reset_stats()
+        self._queues = {stage: asyncio.Queue(maxsize=self.queue_size) for stage in self.STAGES[1:]}
+        started = time.perf_counter()
+        work_dir = tempfile.mkdtemp(prefix="ingest-")
+        reporter = asyncio.create_task(self._reporter(started)) if self.report_interval else None
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                await asyncio.gather(
+                    self._partition_stage(pdf_paths, pool, work_dir),
+                    self._prepare_stage(pool),
+                    self._summarize_stage(work_dir),
+                    self._store_stage()
+                )
+        finally:
+            if reporter:
+                reporter.cancel()
+            shutil.rmtree(work_dir, ignore_errors=True)
+        elapsed = time.perf_counter() - started
+        self.report(elapsed)
+        print(f"Summary cache: {self.cache.stats()}")
+        if self._failed:
+            print(f"Failed documents ({len(self._failed)}): {', '.join(sorted(self._failed))}")
+        return {**self.stats, "failed_sources": sorted(self._failed), "elapsed_seconds": round(elapsed, 2)}
+
+    def run(self, pdf_paths):
+        return asyncio.run(self.arun(pdf_paths))
+
+# Command-line entry point: python multimodal_rag.py <pdf or directory>
+def main(argv=None):
+    import argparse
+    from dotenv import load_dotenv
+    from langchain_chroma import Chroma
+    from langchain_community.storage import RedisStore
+    from langchain_community.utilities.redis import get_client
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.rate_limiters import InMemoryRateLimiter
+    from langchain_core.runnables import RunnablePassthrough
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+    parser = argparse.ArgumentParser(description="Stream PDFs into the multimodal RAG index")
+    parser.add_argument("input", help="PDF file or directory searched recursively for PDFs")
+    parser.add_argument("--persist-directory", default=os.getenv("CHROMA_PERSIST_DIRECTORY", "chroma_mm_rag"))
+    parser.add_argument("--collection", default="mm_rag")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", "redis://localhost:6379"))
+    parser.add_argument("--summary-cache", default=SUMMARY_CACHE_PATH)
+    parser.add_argument("--table-store", default=TABLE_STORE_PATH)
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--embedding-model", default="text-embedding-3-small")
+    parser.add_argument("--queue-size", type=int, default=PIPELINE_QUEUE_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--pages-per-chunk", type=int, default=PAGES_PER_CHUNK)
+    parser.add_argument("--chunk-max-tokens", type=int, default=CHUNK_MAX_TOKENS)
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    limiter = InMemoryRateLimiter(requests_per_second=5, max_bucket_size=10)
+    chat = ChatOpenAI(model=args.model, temperature=0, rate_limiter=limiter)
+    summarize_chain = (
+        {"element": RunnablePassthrough()}
+        | ChatPromptTemplate.from_template(TEXT_SUMMARY_PROMPT)
+        | chat
+        | StrOutputParser()
+    )
+    vectorstore = Chroma(
+        collection_name=args.collection,
+        embedding_function=OpenAIEmbeddings(model=args.embedding_model),
+        collection_metadata={"hnsw:space": "cosine"},
+        persist_directory=args.persist_directory,
+    )
+    docstore = RedisStore(client=get_client(args.redis_url))
+
+    pipeline = IngestionPipeline(
+        vectorstore, docstore, summarize_chain, chat, SummaryCache(args.summary_cache), args.model,
+        queue_size=args.queue_size, workers=args.workers, max_concurrency=args.concurrency,
+        pages_per_chunk=args.pages_per_chunk, report_interval=args.report_interval,
+        table_store=TableStore(args.table_store), chunk_max_tokens=args.chunk_max_tokens
+    )
+    return pipeline.run(iter_pdf_paths(args.input))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+RAG evaluation - concurrent, resumable batch evaluation used by EndtoEndEvaluation.py
+"""
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+
+# Questions answered at once through the RAG chain
+EVAL_ANSWER_CONCURRENCY = int(os.getenv("EVAL_ANSWER_CONCURRENCY", "8"))
+
+# Judge (metric) calls in flight at once, and the most judge calls started per second
+EVAL_METRIC_CONCURRENCY = int(os.getenv("EVAL_METRIC_CONCURRENCY", "16"))
+EVAL_REQUESTS_PER_SECOND = float(os.getenv("EVAL_REQUESTS_PER_SECOND", "5"))
+
+# Default location of the persistent judge-result cache
+JUDGE_CACHE_PATH = os.getenv("JUDGE_CACHE_PATH", "judge_cache.sqlite")
+
+# Test-case fields a metric may read, used when it does not declare its own
+TEST_CASE_FIELDS = ("input", "actual_output", "expected_output", "context", "retrieval_context")
+
+# Function to describe a metric's configuration for the cache key
+def metric_config(metric):
+    """
+    Class, threshold, judge model and, for GEval, name/criteria/steps; anything that
+    changes the verdict for the same test case
+    """
+    model = getattr(metric, "evaluation_model", None) or getattr(metric, "model", None)
+    if model is not None and hasattr(model, "get_model_name"):
+        model = model.get_model_name()
+    config = {"class": type(metric).__name__, "model": str(model)}
+    for attr in ("name", "threshold", "criteria", "evaluation_steps", "rubric",
+                 "include_reason", "strict_mode", "async_mode"):
+        value = getattr(metric, attr, None)
+        if value is not None and not callable(value):
+            config[attr] = value if isinstance(value, (str, int, float, bool, list)) else str(value)
+    return config
+
+# Function to list the test-case fields a metric actually reads
+def metric_fields(metric):
+    params = getattr(metric, "_required_params", None) or getattr(metric, "evaluation_params", None)
+    if not params:
+        return TEST_CASE_FIELDS
+    fields = {getattr(param, "value", str(param)) for param in params}
+    # Every metric judges the question and answer, even when it does not declare them
+    return tuple(field for field in TEST_CASE_FIELDS if field in fields | {"input", "actual_output"})
+
+class JudgeCache:
+    """
+    Persistent cache of metric verdicts.
+
+    Keys are sha256(metric name, metric config, the test-case fields the metric reads),
+    so a re-run only re-judges cases whose relevant inputs changed, and changing a
+    threshold, judge model or GEval criteria invalidates just that metric.
+    """
+
+    def __init__(self, path=JUDGE_CACHE_PATH):
+        self.path = path
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(name, metric, test_case):
+        payload = {
+            "metric": name,
+            "config": metric_config(metric),
+            "case": {field: getattr(test_case, field, None) for field in metric_fields(metric)}
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, name, key):
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM verdicts WHERE key = ?", (key,)).fetchone()
+            counts = self.hits if row else self.misses
+            counts[name] = counts.get(name, 0) + 1
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, result):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO verdicts (key, result) VALUES (?, ?)", (key, json.dumps(result)))
+            self._conn.commit()
+
+    def stats(self):
+        """
+        Hit rate overall and per metric for this run
+        """
+        def rate(hits, misses):
+            total = hits + misses
+            return {"hits": hits, "misses": misses, "hit_rate": round(hits / total, 3) if total else 0.0}
+
+        names = sorted(set(self.hits) | set(self.misses))
+        return {
+            **rate(sum(self.hits.values()), sum(self.misses.values())),
+            "per_metric": {name: rate(self.hits.get(name, 0), self.misses.get(name, 0)) for name in names}
+        }
+
+class AsyncRateLimiter:
+    """
+    Spaces out request starts so at most requests_per_second begin each second
+    """
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+# Function to read the JSONL records written so far, keyed by case id
+def load_jsonl(path):
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut off by an interruption; that case is simply redone
+                continue
+            records[record["id"]] = record
+    return records
+
+# Function to append one record to a JSONL file and flush it to disk
+def _append_jsonl(f, record):
+    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    f.flush()
+
+# Function to answer every eval question with the RAG chain, in bounded concurrent batches
+def generate_answers(rag_chain, rows, answers_path, max_concurrency=EVAL_ANSWER_CONCURRENCY, batch_size=None):
+    """
+    Answers are appended to answers_path as they complete, so an interrupted run
+    only answers the questions that are missing
+
+    Args:
+        rag_chain: Chain like rag_chain_w_sources returning {"question", "context", "response"}
+        rows: Dicts with "id", "question" and optionally "expected_output"
+        answers_path: JSONL file with one answer record per case
+        max_concurrency: Chain invocations in flight at once
+        batch_size: Questions per .batch call (and per checkpoint), defaults to 4 * max_concurrency
+
+    Returns:
+        {id: answer record} for every row
+    """
+    answers = load_jsonl(answers_path)
+    pending = [row for row in rows if row["id"] not in answers]
+    print(f"Answers: {len(rows) - len(pending)} already done, {len(pending)} to generate")
+    batch_size = batch_size or 4 * max_concurrency
+
+    with open(answers_path, "a", encoding="utf-8") as f:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            started = time.perf_counter()
+            results = rag_chain.batch(
+                [row["question"] for row in batch],
+                {"max_concurrency": max_concurrency},
+                return_exceptions=True
+            )
+            for row, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    print(f"Answer failed for {row['id']}: {result}")
+                    continue
+                record = {
+                    "id": row["id"],
+                    "question": row["question"],
+                    "response": result["response"],
+                    "retrieval_context": [doc.page_content for doc in result["context"]],
+                    "expected_output": row.get("expected_output")
+                }
+                answers[row["id"]] = record
+                _append_jsonl(f, record)
+            print(f"Answered {start + len(batch)}/{len(pending)} "
+                  f"({len(batch) / (time.perf_counter() - started):.2f} questions/sec)")
+    return answers
+
+# Function to build the deepeval test case for one answer record
+def build_test_case(answer):
+    from deepeval.test_case import LLMTestCase
+
+    return LLMTestCase(
+        input=answer["question"],
+        actual_output=answer["response"],
+        expected_output=answer.get("expected_output"),
+        retrieval_context=answer["retrieval_context"],
+        # HallucinationMetric and context-based GEval read `context`
+        context=answer["retrieval_context"]
+    )
+
+# Function to score one metric on one test case
+async def _score_metric(name, metric_factory, test_case, semaphore, rate_limiter, cache=None):
+    # A fresh metric per case: deepeval metrics keep score and reason on the instance
+    metric = metric_factory()
+    key = None
+    if cache is not None:
+        key = JudgeCache.make_key(name, metric, test_case)
+        cached = cache.get(name, key)
+        if cached is not None:
+            return name, cached
+    async with semaphore:
+        await rate_limiter.acquire()
+        try:
+            await metric.a_measure(test_case, _show_indicator=False)
+        except Exception as e:
+            return name, {"score": None, "success": False, "reason": None, "error": str(e)}
+    result = {
+        "score": metric.score,
+        "success": bool(metric.success),
+        "reason": getattr(metric, "reason", None),
+        "error": None
+    }
+    # Failed judge calls are not cached, so they are retried next run
+    if cache is not None:
+        cache.put(key, result)
+    return name, result
+
+# Function to score every metric for one case and checkpoint the result
+async def _score_case(answer, metric_factories, semaphore, rate_limiter, f, cache=None):
+    test_case = build_test_case(answer)
+    scored = await asyncio.gather(*(
+        _score_metric(name, factory, test_case, semaphore, rate_limiter, cache)
+        for name, factory in metric_factories.items()
+    ))
+    record = {**answer, "metrics": dict(scored)}
+    _append_jsonl(f, record)
+    return record
+
+# Function to aggregate per-case results into per-metric statistics
+def aggregate_results(records, metric_names):
+    summary = {"cases": len(records), "metrics": {}}
+    for name in metric_names:
+        results = [record["metrics"][name] for record in records if name in record["metrics"]]
+        scores = [result["score"] for result in results if result["score"] is not None]
+        summary["metrics"][name] = {
+            "scored": len(scores),
+            "errors": sum(1 for result in results if result["error"]),
+            "mean_score": round(sum(scores) / len(scores), 4) if scores else None,
+            "pass_rate": round(sum(1 for result in results if result["success"]) / len(results), 4) if results else None
+        }
+    return summary
+
+# Function to write per-case results as Parquet, one row per case with a score/success column per metric
+def write_parquet(records, path):
+    import pandas as pd
+
+    rows = []
+    for record in records:
+        row = {key: record[key] for key in ("id", "question", "response", "expected_output")}
+        for name, result in record["metrics"].items():
+            row[f"{name}_score"] = result["score"]
+            row[f"{name}_success"] = result["success"]
+        rows.append(row)
+    try:
+        pd.DataFrame(rows).to_parquet(path, index=False)
+    except ImportError as e:
+        # Parquet needs pyarrow or fastparquet; JSONL results are still complete
+        print(f"Skipping Parquet output: {e}")
+
+async def arun_evaluation(rag_chain, rows, metric_factories, output_dir,
+                          answer_concurrency=EVAL_ANSWER_CONCURRENCY,
+                          metric_concurrency=EVAL_METRIC_CONCURRENCY,
+                          requests_per_second=EVAL_REQUESTS_PER_SECOND, judge_cache=None):
+    """
+    Answer every row through the RAG chain, then score all metrics for all cases concurrently.
+
+    Results are checkpointed per case to JSONL, so re-running after an interruption
+    (same output_dir) skips answered questions and scored cases.
+
+    Args:
+        rag_chain: Chain like rag_chain_w_sources
+        rows: Dicts with "id", "question" and optionally "expected_output"
+        metric_factories: {name: zero-argument callable returning a new deepeval metric}
+        output_dir: Receives answers.jsonl, results.jsonl, results.parquet and summary.json
+        answer_concurrency: RAG chain invocations in flight at once
+        metric_concurrency: Judge calls in flight at once
+        requests_per_second: Max judge calls started per second (0 disables the limit)
+        judge_cache: Optional JudgeCache; cached verdicts are reused instead of calling the judge
+
+    Returns:
+        Aggregate summary dict
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, "results.jsonl")
+    started = time.perf_counter()
+
+    answers = await asyncio.to_thread(
+        generate_answers, rag_chain, rows, os.path.join(output_dir, "answers.jsonl"), answer_concurrency
+    )
+
+    results = load_jsonl(results_path)
+    # A case is done only if every configured metric was scored without error
+    done = {
+        case_id for case_id, record in results.items()
+        if all(name in record["metrics"] and not record["metrics"][name]["error"] for name in metric_factories)
+    }
+    pending = [answers[row["id"]] for row in rows if row["id"] in answers and row["id"] not in done]
+    print(f"Scoring: {len(done)} cases already scored, {len(pending)} cases x {len(metric_factories)} metrics to go")
+
+    semaphore = asyncio.Semaphore(metric_concurrency)
+    rate_limiter = AsyncRateLimiter(requests_per_second)
+    with open(results_path, "a", encoding="utf-8") as f:
+        scored = await asyncio.gather(*(
+            _score_case(answer, metric_factories, semaphore, rate_limiter, f, judge_cache) for answer in pending
+        ))
+    for record in scored:
+        results[record["id"]] = record
+
+    records = [results[row["id"]] for row in rows if row["id"] in results]
+    summary = aggregate_results(records, list(metric_factories))
+    summary["elapsed_seconds"] = round(time.perf_counter() - started, 2)
+    if judge_cache is not None:
+        summary["judge_cache"] = judge_cache.stats()
+    write_parquet(records, os.path.join(output_dir, "results.parquet"))
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+    return summary
+
+# Function to run the evaluation from a script (inside a notebook use `await arun_evaluation(...)`)
+def run_evaluation(*args, **kwargs):
+    return asyncio.run(arun_evaluation(*args, **kwargs))